@@ -1,8 +1,12 @@
 #!/usr/bin/python
 
-import sys
-import misc_utils as utils
-from Bio import AlignIO
+import os
+import struct
+import hashlib
+import numpy as np
+
+#Default number of columns per window for consensus_windows
+WINDOW = 100000
 
 ############################# CLASSES ##################################
 
@@ -10,17 +14,351 @@ class consensAlign():
 	'Consensus alignment object'
 	#Default constructor
 	def __init__(self, alignment, threshold, mask):
-		self.alnVars = []
-		self.conSequence = make_consensus(alignment, threshold, mask)
-		self.alnVars = get_vars(self.conSequence)
+		self.alnVars = variableSites()
+		self.threshold = threshold
+		self.mask = mask
+		#Per-column counts are kept, so more samples can be added later
+		self.profile = make_profile(alignment)
+		self._call()
+
+	#Call consensus and variable positions from the current profile
+	def _call(self):
+		self.depth = self.profile.depth
+		self.conSequence = self.profile.consensus(self.threshold, self.mask)
+		self.alnVars = get_vars(self.conSequence, profile=self.profile)
+
+	#4-bit set of bases seen at each variable position
+	@property
+	def alleles(self):
+		return self.alnVars.codes
+
+	#Fold in more samples without revisiting existing ones. Accepts another
+	#consensAlign or columnProfile (e.g. a partial state from another batch),
+	#or an iterable of [name, seq] records
+	#Returns 0-based positions that were invariant before and are now variable
+	def update(self, other):
+		if self.profile is None:
+			raise ValueError("Catalog has no column counts (loaded from a sidecar), can't be updated")
+		before = self.alnVars.positions
+		if isinstance(other, consensAlign):
+			if other.profile is None:
+				raise ValueError("Catalog has no column counts (loaded from a sidecar), can't be merged")
+			self.profile.merge(other.profile)
+		elif isinstance(other, columnProfile):
+			self.profile.merge(other)
+		else:
+			for rec in other:
+				self.profile.add_sequence(rec[1])
+		self._call()
+		after = self.alnVars.positions
+		return([int(p) for p in after[~np.isin(after, before)]])
+
+	#Build catalog in a single streaming pass over [name, seq] records
+	#(e.g. read_fasta), without holding the alignment in memory
+	@classmethod
+	def from_records(cls, records, threshold, mask):
+		profile = columnProfile()
+		for rec in records:
+			profile.add_sequence(rec[1])
+		return cls(profile, threshold, mask)
+
+	#Build catalog for a FASTA file, re-using the <fasta>.cat sidecar if it was
+	#made from the same file (size, mtime or content hash) with the same
+	#threshold and mask. Otherwise the FASTA is scanned and the sidecar saved
+	#If window is given, columns are read in windows of that width instead
+	#(see from_windows)
+	@classmethod
+	def from_fasta(cls, fas, threshold, mask, cache=True, window=None):
+		if cache:
+			sidecar = fas + ".cat"
+			found = read_catalog(sidecar)
+			if found is not None:
+				key, new = found
+				if catalog_matches(fas, key, threshold, mask):
+					return new
+		if window:
+			new = cls.from_windows(fas, threshold, mask, window)
+		else:
+			from fasta_tools import read_fasta
+			new = cls.from_records(read_fasta(fas), threshold, mask)
+		if cache:
+			write_catalog(sidecar, catalog_key(fas, threshold, mask), new)
+		return new
+
+	#Build catalog for a FASTA one window of columns at a time (see
+	#consensus_windows), so memory is bounded by samples x window rather
+	#than alignment length. The result has no column counts (can't be updated)
+	#Samples are read through the FASTA's index, so they are checked against
+	#the records of read_fasta (ValueError if the number differs)
+	@classmethod
+	def from_windows(cls, fas, threshold, mask, window=WINDOW):
+		from fasta_tools import read_fasta
+		con = list()
+		sites = list()
+		depth = 0
+		for start, depth, con_window, profile in consensus_windows(fas, threshold, mask, window):
+			con.append(con_window)
+			sites.append(get_vars(con_window, start, profile))
+		nrecords = sum(1 for rec in read_fasta(fas))
+		if depth != nrecords:
+			raise ValueError("Index of %s has %s sequences, but the FASTA has %s records"%(fas, depth, nrecords))
+		new = cls.from_catalog("".join(con), depth, variableSites.concat(sites))
+		new.threshold = threshold
+		new.mask = mask
+		return new
+
+	#Rebuild from stored consensus, depth and variableSites
+	@classmethod
+	def from_catalog(cls, con, depth, sites):
+		new = cls.__new__(cls)
+		new.threshold = None
+		new.mask = None
+		new.profile = None
+		new.depth = depth
+		new.conSequence = con
+		new.alnVars = sites
+		return new
+
+class columnProfile():
+	'Per-column base presence, allele, N/gap and soft-mask counts for an alignment'
+	#Default constructor
+	#allele_count holds diploid counts of A, C, G and T (one row each): a base
+	#counts twice, a two-base ambiguity code once for each base, and anything
+	#else (N, gap, B/D/H/V) is a missing genotype
+	def __init__(self, length=0):
+		self.depth = 0
+		self.presence = np.zeros(length, dtype=np.uint8) #OR of A/C/G/T bits
+		self._allele_count = np.zeros((4, length), dtype=np.int64)
+		#Recent allele counts, one byte per base packed in a uint32 per column
+		#(see _ALLELE_WORD), folded into _allele_count before a byte can overflow
+		self._pending = np.zeros(length, dtype="<u4")
+		self._npending = 0
+		self.n_count = np.zeros(length, dtype=np.int64)
+		self.gap_count = np.zeros(length, dtype=np.int64)
+		self.lower_count = np.zeros(length, dtype=np.int64)
+
+	#Build profile from a 2-D uint8 array of characters (see alignment_to_array)
+	@classmethod
+	def from_array(cls, arr):
+		new = cls(arr.shape[1])
+		if arr.shape[0] > 0:
+			new.add_codes(encode_iupac(arr), _IS_LOWER[arr])
+		return new
+
+	#Add a single sequence string; the first sequence sets the profile length
+	def add_sequence(self, seq):
+		arr = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+		if self.depth == 0 and len(self) == 0:
+			self.__init__(len(arr))
+		elif len(arr) != len(self):
+			raise ValueError("Sequence has length %s, expected %s"%(len(arr), len(self)))
+		self.add_codes(encode_iupac(arr), _IS_LOWER[arr])
+
+	#Add 4-bit codes (and lower case flags) for one sequence or a 2-D block
+	def add_codes(self, codes, lower):
+		codes = np.atleast_2d(codes)
+		lower = np.atleast_2d(lower)
+		self.depth += codes.shape[0]
+		self.n_count += np.count_nonzero(codes == 15, axis=0)
+		self.gap_count += np.count_nonzero(codes == 0, axis=0)
+		self.lower_count += np.count_nonzero(lower, axis=0)
+		for start in range(0, codes.shape[0], _PENDING_ROWS):
+			block = codes[start:start+_PENDING_ROWS]
+			if self._npending + block.shape[0] > _PENDING_ROWS:
+				self._flush()
+			self._pending += _ALLELE_WORD[block].sum(axis=0, dtype="<u4")
+			self._npending += block.shape[0]
+		#N contributes no bases to the presence mask
+		self.presence |= np.bitwise_or.reduce(np.where(codes == 15, 0, codes), axis=0).astype(np.uint8)
+
+	#Fold pending packed allele counts into _allele_count
+	def _flush(self):
+		if self._npending:
+			self._allele_count += self._pending.view(np.uint8).reshape(-1, 4).T
+			self._pending[:] = 0
+			self._npending = 0
+
+	#Diploid A/C/G/T counts for each column (4 x length)
+	@property
+	def allele_count(self):
+		self._flush()
+		return self._allele_count
+
+	#Add counts from another columnProfile (e.g. built from another batch of samples)
+	def merge(self, other):
+		if other.depth == 0:
+			return
+		if self.depth == 0 and len(self) == 0:
+			self.__init__(len(other))
+		elif len(other) != len(self):
+			raise ValueError("Profile has length %s, expected %s"%(len(other), len(self)))
+		self.depth += other.depth
+		self.presence |= other.presence
+		self._flush()
+		self._allele_count += other.allele_count
+		self.n_count += other.n_count
+		self.gap_count += other.gap_count
+		self.lower_count += other.lower_count
+
+	#Save counts to a .npz file, so a partial state can be merged later
+	def save(self, path):
+		np.savez(path, depth=self.depth, presence=self.presence, allele_count=self.allele_count, \
+			n_count=self.n_count, gap_count=self.gap_count, lower_count=self.lower_count)
+
+	#Load counts saved with save()
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			new = cls(len(data["presence"]))
+			new.depth = int(data["depth"])
+			new.presence[:] = data["presence"]
+			new._allele_count[:] = data["allele_count"]
+			new.n_count[:] = data["n_count"]
+			new.gap_count[:] = data["gap_count"]
+			new.lower_count[:] = data["lower_count"]
+		return new
+
+	def __len__(self):
+		return len(self.presence)
+
+	#Returns number of samples without a diploid genotype (see allele_count) in each column
+	def missing(self):
+		return(self.depth - self.allele_count.sum(axis=0) // 2)
+
+	#Returns consensus IUPAC string for all columns
+	#N or gap is called if it meets threshold (N takes precedence), otherwise
+	#the ambiguity code of all bases present. Columns with a proportion of
+	#lower case bases above mask are returned lower case
+	def consensus(self, threshold=0.1, mask=0.1):
+		if self.depth == 0:
+			return("")
+		depth = float(self.depth)
+		cons = _CONS_CHAR[self.presence]
+		cons[(self.gap_count/depth) >= threshold] = ord("-")
+		cons[(self.n_count/depth) >= threshold] = ord("N")
+		masked = (self.lower_count/depth) > mask
+		cons[masked] = _TO_LOWER[cons[masked]]
+		return(cons.tobytes().decode("ascii"))
+
+class variableSites():
+	'Variable positions (0-based, sorted) and their IUPAC codes, stored as parallel arrays'
+	#Default constructor
+	#codes are 4-bit IUPAC codes (see encode_iupac), i.e. the set of bases at each site
+	#Optionally, counts are diploid A/C/G/T counts (one row per site) and missing
+	#the number of samples with no genotype (see columnProfile); needed by filter_mask
+	def __init__(self, positions=None, codes=None, counts=None, missing=None):
+		if positions is None:
+			positions = list()
+		if codes is None:
+			codes = list()
+		self.positions = np.asarray(positions, dtype=np.int32)
+		self.codes = np.asarray(codes, dtype=np.uint8)
+		if len(self.positions) != len(self.codes):
+			raise ValueError("Got %s positions but %s codes"%(len(self.positions), len(self.codes)))
+		self.n_alleles = _POPCOUNT[self.codes] #number of bases at each site
+		self.counts = None
+		self.missing = None
+		if counts is not None:
+			self.counts = np.asarray(counts, dtype=np.int32).reshape(-1, 4)
+			self.missing = np.asarray(missing, dtype=np.int32)
+			if len(self.counts) != len(self.positions) or len(self.missing) != len(self.positions):
+				raise ValueError("Got %s positions but %s allele counts"%(len(self.positions), len(self.counts)))
+
+	#Join sites from consecutive windows (positions must already be offset)
+	@classmethod
+	def concat(cls, sites):
+		sites = list(sites)
+		if len(sites) == 0:
+			return cls()
+		if any(s.counts is None for s in sites):
+			return cls(np.concatenate([s.positions for s in sites]), np.concatenate([s.codes for s in sites]))
+		return cls(np.concatenate([s.positions for s in sites]), np.concatenate([s.codes for s in sites]), \
+			np.concatenate([s.counts for s in sites]), np.concatenate([s.missing for s in sites]))
+
+	def __len__(self):
+		return len(self.positions)
+
+	#Integer index returns a variablePosition view; slices, index arrays and
+	#boolean masks return a new variableSites
+	def __getitem__(self, key):
+		if isinstance(key, (int, np.integer)):
+			if key < 0:
+				key += len(self)
+			if key < 0 or key >= len(self):
+				raise IndexError("variableSites index out of range")
+			return variablePosition.from_sites(self, int(key))
+		if self.counts is None:
+			return variableSites(self.positions[key], self.codes[key])
+		return variableSites(self.positions[key], self.codes[key], self.counts[key], self.missing[key])
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield(variablePosition.from_sites(self, i))
+
+	def __contains__(self, position):
+		return self.find(position) >= 0
+
+	#Returns index of a position, or -1 if it is not variable (binary search)
+	def find(self, position):
+		i = int(np.searchsorted(self.positions, position))
+		if i < len(self) and self.positions[i] == position:
+			return i
+		return -1
+
+	#Returns sites with start <= position < end (binary search)
+	def range(self, start, end):
+		lo, hi = np.searchsorted(self.positions, [start, end])
+		return self[lo:hi]
+
+	#Returns IUPAC characters for all sites, as a string
+	def values(self):
+		return(_CODE_CHAR[self.codes].tobytes().decode("ascii"))
+
+	#True where the site has more than two bases (coded as multi-allelic for PHASE)
+	def multiallelic(self):
+		return self.n_alleles > 2
+
+	#Returns diploid count of all but the most common base at each site
+	def minor_count(self):
+		if self.counts is None:
+			raise ValueError("Sites have no allele counts")
+		return(self.counts.sum(axis=1) - self.counts.max(axis=1))
+
+	#Returns True for sites passing filters: minor allele count of at least mac,
+	#a proportion of depth samples missing of at most max_missing, and (if
+	#biallelic) no more than two bases
+	def filter_mask(self, depth, mac=0, max_missing=1.0, biallelic=False):
+		keep = np.ones(len(self), dtype=bool)
+		if mac > 0:
+			keep &= self.minor_count() >= mac
+		if max_missing < 1.0:
+			if self.missing is None:
+				raise ValueError("Sites have no missing data counts")
+			keep &= self.missing <= max_missing * depth
+		if biallelic:
+			keep &= ~self.multiallelic()
+		return(keep)
 
 class variablePosition():
 	'Object to hold information about a variable position'
+	#Either holds its own position and value, or is a view on one site of a
+	#variableSites (see from_sites)
+	__slots__ = ("_sites", "_index", "_position", "_value")
+
 	#Default constructor
 	def __init__(self, pos=None, val=None):
-		self.position = pos
-		self.value = val.upper()
+		self._sites = None
+		self._index = None
+		self._position = pos
+		self._value = val.upper()
 
+	#View on site index of a variableSites; nothing is copied
+	@classmethod
+	def from_sites(cls, sites, index):
+		new = cls.__new__(cls)
+		new._sites = sites
+		new._index = index
+		return new
 
 	@classmethod
 	def from_list(cls, data):
@@ -29,98 +367,180 @@ class variablePosition():
 		new = cls(pos, val)
 		return new
 
+	@property
+	def position(self):
+		if self._sites is None:
+			return self._position
+		return int(self._sites.positions[self._index])
+
+	@position.setter
+	def position(self, pos):
+		if self._sites is None:
+			self._position = pos
+		else:
+			self._sites.positions[self._index] = pos
+
+	@property
+	def value(self):
+		if self._sites is None:
+			return self._value
+		return chr(_CODE_CHAR[self._sites.codes[self._index]])
+
 
 
 ######################## STATIC FUNCTIONS ##############################
 
 #Less shitty consensus function than BioPython has..
-#From an AlignIO alignment object
+#From an AlignIO alignment object (or any list of sequences/ [name, seq] pairs)
+#Columns are all evaluated at once on a 2-D uint8 array (see columnProfile)
+#A pre-built columnProfile can also be passed in
 def make_consensus(alignment, threshold=0.1, mask=0.1):
-	aln_depth = len(alignment)
-	#If only one sequence in alignment, return that seq as consensus
-	if aln_depth == 1:
-		return alignment[:,0]
-	aln_len = alignment.get_alignment_length()
-	consensus="" #consensus string to build
-	#For each column
-	for i in range(aln_len):
-		#For each character in column, grab occurences
-		col_len = len((alignment[:,i]))
-		nuc_count = dict() #dictionary to track occurences
-		nuc_types = 0 #track number of things we found
-		ismask = 0 #Track if we should mask this column
-		#Check number of masked bases
-		nlower = utils.n_lower_chars(alignment[:,i])
-		prop_mask = float(nlower/aln_depth)
-		if prop_mask > mask:
-			ismask = 1
-
-		for c in ((alignment[:,i]).upper()):
-			for nuc in get_iupac(c):
-				nuc_count[nuc] = nuc_count.get(nuc,0)+1
-				#print(nuc, end='', flush=True)
-		nucs= []
-		add = 0
-		for key_raw in nuc_count:
-			key = key_raw
-			if ismask: #If masked above threshold, set to lower case
-				key = key_raw.lower()
-			#print(key, " is ", nuc_count[key])
-			#If only one nuc type, keep it
-			if nuc_types == 1:
-				consensus+=str(key)
-				add=1
-				break
-			#If N or gap, call consensus N or gap if above threshold
-			elif key in ("N", "n", "-"):
-				temp = key
-				if key == "n":
-					temp = "N"
-				if float((nuc_count[temp])/aln_depth) >= threshold:
-					#print("Found ", nuc_count[key], key, "'s in alignment")
-					#print((nuc_count[key])/aln_depth)
-					consensus+=str(key)
-					add=1
-					break
-			else:
-				nucs.append(str(key))
-		if add == 0:
-			temp = utils.listToSortUniqueString(nucs)
-			consensus+=reverse_iupac_case(temp)
-	return(consensus)
-
-#Function to get a list of variablePositions
-def get_vars(con):
+	return(make_profile(alignment).consensus(threshold, mask))
+
+#Function to get a columnProfile for an alignment or profile
+def make_profile(alignment):
+	if isinstance(alignment, columnProfile):
+		return(alignment)
+	else:
+		return(columnProfile.from_array(alignment_to_array(alignment)))
+
+#Function to evaluate a FASTA alignment in windows of columns, read through
+#its .fai index (see fasta_tools.fastaIndex), holding one window of all
+#samples at a time. This is a generator function, yielding
+#(window start, number of samples, consensus string, columnProfile) per window
+def consensus_windows(fas, threshold=0.1, mask=0.1, window=WINDOW):
+	from fasta_tools import fastaIndex
+	with fastaIndex(fas) as index:
+		lengths = set(index.length(name) for name in index.names)
+		if len(lengths) > 1:
+			raise ValueError("Sequences in %s are not all the same length"%fas)
+		length = lengths.pop() if lengths else 0
+		arr = np.empty((len(index), min(window, length)), dtype=np.uint8)
+		for start in range(0, length, window):
+			end = min(start+window, length)
+			block = arr[:, :end-start]
+			for i, name in enumerate(index.names):
+				block[i] = np.frombuffer(index.fetch(name, start, end).encode("ascii"), dtype=np.uint8)
+			profile = columnProfile.from_array(block)
+			yield((start, len(index), profile.consensus(threshold, mask), profile))
+
+#Function to stream variablePositions for a FASTA alignment, one window of
+#columns at a time (see consensus_windows). This is a generator function
+def iter_vars(fas, threshold=0.1, mask=0.1, window=WINDOW):
+	for start, depth, con, profile in consensus_windows(fas, threshold, mask, window):
+		for var in get_vars(con, start):
+			yield(var)
+
+#Function to get variableSites for a consensus sequence (positions are offset
+#by start, e.g. for a window of a longer alignment)
+#If the columnProfile of the consensus is given, allele counts are kept for each site
+def get_vars(con, start=0, profile=None):
 	#print("Parsing: ", con)
-	var_objects = [] #empty list for holding var objects
-	#For each position
-	for i in range(len(con)):
-		#print(i, " is ", con[i])
-		#If not monomorphic
-		if con[i].upper() not in {"A", "G", "T", "C", "N", "-"}:
-			var_objects.append(variablePosition(i, con[i].upper()))
-			#continue
-		#else:
-		'''
-		#For each sequence
-		for c in range(len(aln[:,i])):
-			#print(aln[c,i], end='', flush=True)
-			ref = con[i].upper()
-			var = aln[c,i].upper()
-			#ref.upper()
-			#var.upper()
-			#print("Var is ",var, " and Ref is ", ref)
-			if var == ref:
-			#if var == "-" and ref == "-":
-				continue
-			#elif var == "N" and ref == "N":
-				continue
-			else:
-				#print(var, end='', flush=True)
-				#print(aln[c].id, " has ", aln[c,i], " at pos ", i)
-				var_objects.append(variablePosition(aln[c].id, i, aln[c,i]))
-		'''
-	return var_objects
+	#Grab positions of every non-monomorphic column at once
+	chars = np.frombuffer(con.encode("ascii"), dtype=np.uint8)
+	idx = np.flatnonzero(~_MONOMORPHIC[_TO_UPPER[chars]])
+	if profile is None:
+		return variableSites(idx + start, encode_iupac(chars[idx]))
+	counts = profile.allele_count[:, idx].T
+	missing = profile.depth - counts.sum(axis=1) // 2
+	return variableSites(idx + start, encode_iupac(chars[idx]), counts, missing)
+
+#Function to write variable-column haplotypes into full-length sequences
+#seqs are sequences of equal length, haps the variable columns for each (as
+#in PHASE output), and positions the 0-based column of each variable site
+#All rows are filled in one scatter on a 2-D uint8 array. Returns a list of strings
+def fill_haplotypes(seqs, haps, positions):
+	if len(seqs) != len(haps):
+		raise ValueError("Got %s sequences but %s haplotypes"%(len(seqs), len(haps)))
+	if len(seqs) == 0:
+		return(list())
+	pos = np.asarray(positions, dtype=np.intp)
+	length = len(seqs[0])
+	for seq, hap in zip(seqs, haps):
+		if len(seq) != length:
+			raise ValueError("Sequence has length %s, expected %s"%(len(seq), length))
+		if len(hap) != len(pos):
+			raise ValueError("Haplotype has %s variable sites, expected %s"%(len(hap), len(pos)))
+	if len(pos) > 0 and (pos.min() < 0 or pos.max() >= length):
+		raise ValueError("Variable position out of range for sequences of length %s"%length)
+	arr = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8).reshape(len(seqs), length).copy()
+	vals = "".join(haps).encode("ascii")
+	arr[:, pos] = np.frombuffer(vals, dtype=np.uint8).reshape(len(haps), len(pos))
+	return([row.tobytes().decode("ascii") for row in arr])
+
+#Function to load an alignment into a 2-D uint8 array (rows=samples, cols=sites)
+#Accepts an AlignIO alignment, a list of sequence strings, or [name, seq] lists
+def alignment_to_array(alignment):
+	seqs = list()
+	for rec in alignment:
+		if hasattr(rec, "seq"):
+			seqs.append(str(rec.seq))
+		elif isinstance(rec, (list, tuple)):
+			seqs.append(str(rec[1]))
+		else:
+			seqs.append(str(rec))
+	if len(seqs) == 0:
+		return(np.zeros((0,0), dtype=np.uint8))
+	aln_len = len(seqs[0])
+	arr = np.empty((len(seqs), aln_len), dtype=np.uint8)
+	for i, seq in enumerate(seqs):
+		if len(seq) != aln_len:
+			raise ValueError("Sequence %s has length %s, expected %s"%(i, len(seq), aln_len))
+		arr[i] = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+	return(arr)
+
+#Function to convert an array of characters to 4-bit IUPAC codes (A=1,C=2,G=4,T=8)
+#Gaps are coded as 0, N as 15. Raises ValueError on non-IUPAC characters
+def encode_iupac(arr):
+	codes = _IUPAC_CODE[arr]
+	if (codes == _INVALID).any():
+		bad = sorted(set(chr(c) for c in np.unique(arr[codes == _INVALID])))
+		raise ValueError("Invalid character(s) in alignment: %s"%(" ".join(bad)))
+	return(codes)
+
+#Function to convert 4-bit codes back to an IUPAC string
+#If lower (bool array) is given, those positions are returned lower case
+def decode_iupac(codes, lower=None):
+	chars = _CODE_CHAR[codes]
+	if lower is not None:
+		chars = np.where(lower, _TO_LOWER[chars], chars)
+	return(chars.tobytes().decode("ascii"))
+
+#Function to pack 4-bit codes two per byte (first base in the high nibble)
+#Works on the last axis of 1-D or 2-D arrays
+def pack_codes(codes):
+	if codes.shape[-1] % 2:
+		pad = np.zeros(codes.shape[:-1] + (1,), dtype=np.uint8)
+		codes = np.concatenate((codes, pad), axis=-1)
+	return(((codes[...,0::2] << 4) | codes[...,1::2]).astype(np.uint8))
+
+#Function to unpack codes packed with pack_codes, trimmed to length
+def unpack_codes(packed, length):
+	codes = np.empty(packed.shape[:-1] + (packed.shape[-1]*2,), dtype=np.uint8)
+	codes[...,0::2] = packed >> 4
+	codes[...,1::2] = packed & 15
+	return(codes[...,:length])
+
+#Function to pack a sequence string into a compact, hashable bytes object
+#Layout: 4-byte length, packed codes, then packed lower case bits (only if any)
+#With mask=False case is dropped, so the result is a case-insensitive key
+def pack_sequence(seq, mask=True):
+	arr = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+	ret = len(seq).to_bytes(4, "little") + pack_codes(encode_iupac(arr)).tobytes()
+	lower = _IS_LOWER[arr]
+	if mask and lower.any():
+		ret += np.packbits(lower).tobytes()
+	return(ret)
+
+#Function to return the sequence string from pack_sequence bytes
+def unpack_sequence(packed):
+	length = int.from_bytes(packed[:4], "little")
+	ncodes = (length + 1) // 2
+	codes = unpack_codes(np.frombuffer(packed[4:4+ncodes], dtype=np.uint8), length)
+	lower = None
+	if len(packed) > 4 + ncodes:
+		lower = np.unpackbits(np.frombuffer(packed[4+ncodes:], dtype=np.uint8), count=length).astype(bool)
+	return(decode_iupac(codes, lower))
 
 #Function to split character to IUPAC codes, assuing diploidy
 def get_iupac(char):
@@ -205,3 +625,152 @@ def reverse_iupac_case(char):
 		'acgt':'n'
 	}
 	return iupac[char]
+
+#Function to get the sidecar key for a FASTA: size, mtime (ns), BLAKE2b
+#content hash, consensus threshold and mask
+def catalog_key(fas, threshold, mask):
+	stat = os.stat(fas)
+	return((stat.st_size, stat.st_mtime_ns, file_digest(fas), float(threshold), float(mask)))
+
+#Function to check a sidecar key against a FASTA. Size, threshold and mask
+#must match; the content hash is only computed if the mtime has changed
+def catalog_matches(fas, key, threshold, mask):
+	size, mtime, digest, cat_threshold, cat_mask = key
+	if (cat_threshold, cat_mask) != (float(threshold), float(mask)):
+		return False
+	stat = os.stat(fas)
+	if stat.st_size != size:
+		return False
+	return stat.st_mtime_ns == mtime or file_digest(fas) == digest
+
+#Function to hash a file in chunks
+def file_digest(fas, chunk_size=1 << 20):
+	h = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+	with open(fas, "rb") as fh:
+		for chunk in iter(lambda: fh.read(chunk_size), b""):
+			h.update(chunk)
+	return(h.digest())
+
+#Function to write a consensAlign to a binary sidecar file
+#Layout: magic, header (see _CATALOG_HEADER), consensus (ASCII),
+#variable positions (int32) and allele sets (uint8, 4-bit codes), then
+#if present allele counts (int32, 4 per site) and missing counts (int32)
+#Not fatal if the directory is read-only
+def write_catalog(sidecar, key, cat):
+	size, mtime, digest, threshold, mask = key
+	sites = cat.alnVars
+	positions = sites.positions.astype("<i4")
+	con = cat.conSequence.encode("ascii")
+	header = _CATALOG_HEADER.pack(size, mtime, digest, threshold, mask, \
+		cat.depth, len(con), len(positions), sites.counts is not None)
+	try:
+		with open(sidecar, "wb") as fh:
+			fh.write(_CATALOG_MAGIC + header + con)
+			fh.write(positions.tobytes() + sites.codes.tobytes())
+			if sites.counts is not None:
+				fh.write(sites.counts.astype("<i4").tobytes() + sites.missing.astype("<i4").tobytes())
+	except OSError as e:
+		print("Warning: Could not write catalog %s: %s"%(sidecar, e))
+
+#Function to read a sidecar written by write_catalog
+#Returns (key, consensAlign), or None if missing or unreadable
+def read_catalog(sidecar):
+	try:
+		with open(sidecar, "rb") as fh:
+			data = fh.read()
+	except OSError:
+		return None
+	start = len(_CATALOG_MAGIC) + _CATALOG_HEADER.size
+	if data[:len(_CATALOG_MAGIC)] != _CATALOG_MAGIC or len(data) < start:
+		return None
+	size, mtime, digest, threshold, mask, depth, length, nvars, has_counts = \
+		_CATALOG_HEADER.unpack_from(data, len(_CATALOG_MAGIC))
+	if len(data) != start + length + nvars*(25 if has_counts else 5):
+		return None
+	con = data[start:start+length].decode("ascii")
+	offset = start + length
+	positions = np.frombuffer(data, dtype="<i4", count=nvars, offset=offset).copy()
+	codes = np.frombuffer(data, dtype=np.uint8, count=nvars, offset=offset+nvars*4).copy()
+	if has_counts:
+		counts = np.frombuffer(data, dtype="<i4", count=nvars*4, offset=offset+nvars*5)
+		missing = np.frombuffer(data, dtype="<i4", count=nvars, offset=offset+nvars*21)
+		sites = variableSites(positions, codes, counts.reshape(nvars, 4), missing)
+	else:
+		sites = variableSites(positions, codes)
+	key = (size, mtime, digest, threshold, mask)
+	return((key, consensAlign.from_catalog(con, depth, sites)))
+
+######################## LOOKUP TABLES #################################
+
+#Bitmask values for each base; ambiguity codes are the OR of their bases
+_IUPAC_BITS = {
+	"A"	: 1,
+	"C"	: 2,
+	"G"	: 4,
+	"T"	: 8,
+	"R"	: 5,
+	"Y"	: 10,
+	"S"	: 6,
+	"W"	: 9,
+	"K"	: 12,
+	"M"	: 3,
+	"B"	: 14,
+	"D"	: 13,
+	"H"	: 11,
+	"V"	: 7,
+	"N"	: 15,
+	"-"	: 0
+}
+_INVALID = 255
+
+#ASCII -> 4-bit code (case-insensitive), _INVALID for anything else
+_IUPAC_CODE = np.full(256, _INVALID, dtype=np.uint8)
+for _c, _b in _IUPAC_BITS.items():
+	_IUPAC_CODE[ord(_c)] = _b
+	_IUPAC_CODE[ord(_c.lower())] = _b
+
+#4-bit code -> upper case IUPAC character
+_CODE_CHAR = np.zeros(16, dtype=np.uint8)
+for _c, _b in _IUPAC_BITS.items():
+	_CODE_CHAR[_b] = ord(_c)
+
+#Same, for consensus of a base set: empty set (only N/gaps below threshold) is N
+_CONS_CHAR = _CODE_CHAR.copy()
+_CONS_CHAR[0] = ord("N")
+
+#4-bit code -> number of bases
+_POPCOUNT = np.array([bin(_b).count("1") for _b in range(16)], dtype=np.uint8)
+
+#ASCII -> lower case ASCII
+_TO_LOWER = np.arange(256, dtype=np.uint8)
+_TO_LOWER[ord("A"):ord("Z")+1] += 32
+
+#ASCII -> upper case ASCII
+_TO_UPPER = np.arange(256, dtype=np.uint8)
+_TO_UPPER[ord("a"):ord("z")+1] -= 32
+
+#ASCII -> True if lower case
+_IS_LOWER = np.zeros(256, dtype=bool)
+_IS_LOWER[ord("a"):ord("z")+1] = True
+
+#4-bit code -> diploid count of each base (A, C, G, T), one per byte of a
+#uint32: 2 for the base itself, 1 for a two-base ambiguity code containing it
+_ALLELE_DOSE = np.zeros((16, 4), dtype=np.uint8)
+for _b in range(16):
+	for _i in range(4):
+		if _b & (1 << _i) and _POPCOUNT[_b] <= 2:
+			_ALLELE_DOSE[_b, _i] = 3 - _POPCOUNT[_b]
+_ALLELE_WORD = _ALLELE_DOSE.view("<u4").ravel()
+
+#Rows whose packed allele counts can be summed without a byte overflowing
+_PENDING_ROWS = 127
+
+#ASCII -> True if monomorphic consensus character (used by get_vars)
+_MONOMORPHIC = np.zeros(256, dtype=bool)
+for _c in "AGTCN-":
+	_MONOMORPHIC[ord(_c)] = True
+
+#Catalog sidecar format (see write_catalog)
+_CATALOG_MAGIC = b"F2PCAT3\n"
+_DIGEST_SIZE = 32
+_CATALOG_HEADER = struct.Struct("<Qq%ssddQQQ?"%_DIGEST_SIZE)
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+#Micro-benchmark: chunked byte-level read_fasta (fasta_tools) vs. the old
+#line-by-line reader with "seq += line", on wrapped and unwrapped FASTAs
+#Usage: python3 benchmarks/bench_read_fasta.py <n_samples> <seq_length>
+
+import sys
+import os
+import random
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from fasta_tools import read_fasta
+
+def main():
+	nsamp = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	length = int(sys.argv[2]) if len(sys.argv) > 2 else 16569
+	print("%s samples x %s bp"%(nsamp, length))
+	print("%-12s %10s %10s %8s"%("Input", "Line (s)", "Chunk (s)", "Speedup"))
+	with tempfile.TemporaryDirectory() as tmp:
+		for label, width in (("wrapped", 60), ("unwrapped", None)):
+			fas = os.path.join(tmp, label + ".fasta")
+			write_random_fasta(fas, nsamp, length, width)
+			old = best_time(lambda: list(read_fasta_lines(fas)))
+			new = best_time(lambda: list(read_fasta(fas)))
+			assert list(read_fasta_lines(fas)) == list(read_fasta(fas))
+			print("%-12s %10.4f %10.4f %7.1fx"%(label, old, new, old/new))
+
+#The line-by-line reader previously copied into each script
+def read_fasta_lines(fas):
+	with open(fas, 'r') as fh:
+		contig = ""
+		seq = ""
+		for line in fh:
+			line = line.strip()
+			if not line:
+				continue
+			if line[0] == ">":
+				if contig:
+					yield([contig,seq])
+					contig = ""
+					seq = ""
+				split_line = line.split()
+				contig = (split_line[0].replace(">",""))
+			else:
+				seq += line
+		if contig and seq:
+			yield([contig,seq])
+
+def write_random_fasta(fas, nsamp, length, width=None):
+	random.seed(1)
+	with open(fas, "w") as fh:
+		for i in range(nsamp):
+			seq = "".join(random.choice("ACGT") for _ in range(length))
+			fh.write(">sample%s\n"%i)
+			if width:
+				for j in range(0, length, width):
+					fh.write(seq[j:j+width] + "\n")
+			else:
+				fh.write(seq + "\n")
+
+#Returns fastest of several runs, in seconds
+def best_time(func, reps=3):
+	best = None
+	for _ in range(reps):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+#Call main function
+if __name__ == '__main__':
+    main()
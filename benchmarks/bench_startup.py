@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+#Startup-time benchmark: wall time to launch each script and exit from its
+#help menu (i.e. interpreter + imports + argument parsing), compared with a
+#bare interpreter. Also lists which heavy modules each script imports
+#Usage: python3 benchmarks/bench_startup.py <n_runs>
+
+import sys
+import os
+import subprocess
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+#Scripts with a command-line interface
+ENTRY_POINTS = ["fasta2phase.py", "parsePairs.py", "hapFrequency.py", "collapseHaps.py",
+	"makeHapMap.py", "makePopArt.py", "reverseHapFreq.py", "runPhase.py"]
+
+#Modules worth flagging if imported at startup
+HEAVY = ["numpy", "Bio", "pandas", "multiprocessing"]
+
+def main():
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	base = best_time([sys.executable, "-c", "pass"], runs)
+	print("Best of %s runs; bare interpreter: %.1f ms"%(runs, base*1000))
+	print("%-20s %10s %10s  %s"%("Script", "Time (ms)", "Over (ms)", "Heavy imports"))
+	for script in ENTRY_POINTS:
+		path = os.path.join(REPO, script)
+		t = best_time([sys.executable, path, "-h"], runs)
+		print("%-20s %10.1f %10.1f  %s"%(script, t*1000, (t-base)*1000, ",".join(heavy_imports(script)) or "-"))
+
+#Returns heavy modules loaded by importing a script (its main() is not run)
+def heavy_imports(script):
+	code = "import sys; sys.path.insert(0, %r); import %s; print(' '.join(m for m in %r if m in sys.modules))"
+	code = code%(REPO, script.replace(".py", ""), HEAVY)
+	out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True)
+	return out.stdout.split()
+
+#Returns fastest of several runs of a command, in seconds
+def best_time(cmd, reps=10):
+	best = None
+	for _ in range(reps):
+		start = time.perf_counter()
+		subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+#Call main function
+if __name__ == '__main__':
+    main()
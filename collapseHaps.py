@@ -4,6 +4,7 @@ import re
 import sys
 import os
 import getopt
+from fasta_tools import read_fasta
 from collections import OrderedDict
 
 def main():
@@ -85,44 +86,6 @@ def getHapMap(seqs):
 	return(haps)
 
 
-#Read genome as FASTA. FASTA header will be used
-#This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
-
-	if os.path.exists(fas):
-		with open(fas, 'r') as fh:
-			try:
-				contig = ""
-				seq = ""
-				for line in fh:
-					line = line.strip()
-					if not line:
-						continue
-					#print(line)
-					if line[0] == ">": #Found a header line
-						#If we already loaded a contig, yield that contig and
-						#start loading a new one
-						if contig:
-							yield([contig,seq]) #yield
-							contig = "" #reset contig and seq
-							seq = ""
-						split_line = line.split()
-						contig = (split_line[0].replace(">",""))
-					else:
-						seq += line
-				#Iyield last sequence, if it has both a header and sequence
-				if contig and seq:
-					yield([contig,seq])
-			except IOError:
-				print("Could not read file ",fas)
-				sys.exit(1)
-			finally:
-				fh.close()
-	else:
-		raise FileNotFoundError("File %s not found!"%fas)
-
-
 #Object to parse command-line arguments
 class parseArgs():
 	def __init__(self):
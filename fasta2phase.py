@@ -4,81 +4,526 @@ import re
 import sys
 import os
 import getopt
-import Bio
+import glob
+import shutil
+import numpy as np
 import alignment_tools as aln
+import misc_utils as utils
+import vcf_tools as vcf
+from fasta_tools import read_fasta, fastaIndex
 from itertools import product
-from Bio import AlignIO
+
+#Ways of handling samples with known phase (-k)
+KNOWN_MODES = ["file", "hold"]
+
+#File extensions recognized as FASTA when given a directory in batch mode
+FASTA_EXTENSIONS = [".fasta", ".fas", ".fa", ".fna", ".fsa"]
+
+#Diploid genotypes for each IUPAC code, as PHASE alleles
+#Bi-allelic (S) sites use bases, with ? for missing
+IUPAC_DIP = {
+	"A"	: ["A","A"],
+	"G"	: ["G","G"],
+	"C"	: ["C","C"],
+	"T"	: ["T","T"],
+	"N"	: ["?","?"],
+	"-"	: ["?","?"],
+	"R"	: ["A","G"],
+	"Y"	: ["C","T"],
+	"S"	: ["G","C"],
+	"W"	: ["A","T"],
+	"K"	: ["G","T"],
+	"M"	: ["A","C"],
+	"B"	: ["?","?"],
+	"D"	: ["?","?"],
+	"H"	: ["?","?"],
+	"V"	: ["?","?"]
+}
+
+#Multi-allelic (M) sites use integers, with -1 for missing
+IUPAC_MULT = {
+	"A"	: ["0","0"],
+	"G"	: ["1","1"],
+	"C"	: ["2","2"],
+	"T"	: ["3","3"],
+	"N"	: ["-1","-1"],
+	"-"	: ["-1","-1"],
+	"R"	: ["0","1"],
+	"Y"	: ["2","3"],
+	"S"	: ["1","2"],
+	"W"	: ["0","3"],
+	"K"	: ["1","3"],
+	"M"	: ["0","2"],
+	"B"	: ["-1","-1"],
+	"D"	: ["-1","-1"],
+	"H"	: ["-1","-1"],
+	"V"	: ["-1","-1"]
+}
 
 def main():
 	params = parseArgs()
 
+	#If a batch of loci provided:
+	if params.batch:
+		runBatch(params)
+
+	#If loci to combine into one .inp provided:
+	elif params.combine:
+		loci = getBatchLoci(params.combine)
+		if len(loci) == 0:
+			sys.exit("No FASTA files found for input %s"%params.combine)
+		try:
+			res = combine2inp(loci, params.out, window=params.window, known=params.known, filters=params.filters, block=params.block)
+		except ValueError as e:
+			sys.exit("Error: %s"%e)
+		reportOutput(params.out, res[-1])
+
+	#If VCF provided:
+	elif params.vcf:
+		try:
+			res = vcf2inp(params.vcf, params.out, region=params.region, known=params.known, filters=params.filters, block=params.block)
+		except ValueError as e:
+			sys.exit("Error: %s"%e)
+		reportOutput(params.out, res[-1])
+
 	#If fasta provided:
-	if params.fasta:
-		print("Reading FASTA...")
-		#Initialize empty AlignIO object
-		locus = Bio.Align.MultipleSeqAlignment([])
+	elif params.fasta:
+		try:
+			res = fasta2inp(params.fasta, params.out, window=params.window, known=params.known, filters=params.filters, block=params.block)
+		except ValueError as e:
+			sys.exit("Error: %s"%e)
+		reportOutput(params.out, res[-1])
 
-		#Add each sequence to the AlignIO
-		for seq in read_fasta(params.fasta):
-			#Add to AlignIO alignment
-			locus.add_sequence(seq[0], seq[1])
+	else:
+		sys.exit("No input provided.")
 
-		#Generate catalog of variable positions
-		alignment = aln.consensAlign(locus, threshold=1.0, mask=1.0)
+#Function to report where the .inp file(s) of a single run were written
+#With more than one block, these are the block files and the block map
+def reportOutput(out, nblocks):
+	if nblocks > 1:
+		prefix = os.path.splitext(out)[0]
+		print("Done! Output can be found in %s_block*.inp (%s blocks), listed in %s_blocks.tsv"%(prefix, nblocks, prefix))
+	else:
+		print("Done! Output can be found in",out)
 
-		#Print header information to output file
-		out_fh = open(params.out, "w")
+#Function to convert one FASTA alignment to a PHASE .inp file
+#Returns a tuple of (number of samples, number of sites, has multi-allelic sites,
+#number of samples with known phase, number of sites removed by filters, number of blocks)
+#If window is given, the catalog is built window-by-window of columns (bounded memory)
+#filters is (minimum minor allele count, maximum proportion missing, biallelic
+#only); sites failing them are left out (see alignment_tools.variableSites.filter_mask)
+#The alignment column of each site written is listed in <out prefix>_sites.tsv,
+#for parsePairs.py -s
+#Samples with known phase (no missing data, and heterozygous at no more than
+#one site) are handled according to known (see KNOWN_MODES):
+#"file" writes a PHASE -k file (<out prefix>_known.txt) marking them, and
+#"hold" leaves them out of the .inp, writing their haplotypes to
+#<out prefix>_known_pairs for parsePairs.py -k
+#If block is given as (sites per block, overlap), sites are split into
+#overlapping blocks (see siteBlocks) each written to <out prefix>_block<i>.inp,
+#and listed in <out prefix>_blocks.tsv for parsePairs.py -l
+def fasta2inp(fasta, out, verbose=True, window=None, known=None, filters=None, block=None):
+	if verbose:
+		print("Reading FASTA...")
+	#Generate catalog of variable positions in one streaming pass
+	#Only per-column base presence and allele counts are kept, not the sequences
+	#Catalog is saved to <fasta>.cat, and re-used by re-runs and parsePairs.py
+	alignment = aln.consensAlign.from_fasta(fasta, threshold=1.0, mask=1.0, window=window)
 
+	if verbose:
 		print("Calculating variable columns...")
-		#For each variable column, create outputs for positions and types:
-		positions = []
-		types = []
-		for var in alignment.alnVars:
-			positions.append(var.position+1) #add 1 because these are 0-based
-			this_type = ""
-			if var.value.upper() in ['B', 'D', 'H', 'V']:
-				types.append("M")
+	sites, nfiltered = filterSites(alignment, filters, verbose)
+
+	#Each sample's characters at the variable columns (second pass over the FASTA)
+	cols = sites.positions.astype(np.intp)
+	samples = ((name, np.frombuffer(seq.encode("ascii"), dtype=np.uint8)[cols], None) for name, seq in read_fasta(fasta))
+	nsamp, nknown, nblocks = writePhaseInput(out, sites, samples, alignment.depth, verbose, known, block)
+	return((nsamp, len(sites), bool(sites.multiallelic().any()), nknown, nfiltered, nblocks))
+
+#Function to combine several locus FASTAs into one PHASE .inp file
+#loci is a list of (locus, fasta). Samples are matched by name (a sample missing
+#from a locus has missing genotypes there), and each locus's positions are
+#offset by the total length of the loci before it. The sites of each locus are
+#listed in <out prefix>_loci.tsv, for parsePairs.py -L
+#Other arguments, and the returned tuple, are as for fasta2inp
+def combine2inp(loci, out, verbose=True, window=None, known=None, filters=None, block=None):
+	parts = list()
+	cols = list()
+	indexes = list()
+	names = list()
+	seen = set()
+	rows = list()
+	offset = 0
+	nfiltered = 0
+	try:
+		for locus, fas in loci:
+			if verbose:
+				print("Reading FASTA for locus %s..."%locus)
+			alignment = aln.consensAlign.from_fasta(fas, threshold=1.0, mask=1.0, window=window)
+			sites, nf = filterSites(alignment, filters, verbose)
+			nfiltered += nf
+			#Samples are fetched by name from each FASTA
+			index = fastaIndex(fas)
+			indexes.append(index)
+			for name in index.names:
+				if name not in seen:
+					seen.add(name)
+					names.append(name)
+			first = sum(len(p) for p in parts)
+			length = len(alignment.conSequence)
+			rows.append([locus, fas, first+1, first+len(sites), offset, length])
+			cols.append(sites.positions.astype(np.intp))
+			parts.append(aln.variableSites(sites.positions + offset, sites.codes, sites.counts, sites.missing))
+			offset += length
+		sites = aln.variableSites.concat(parts)
+		writeLocusMap(os.path.splitext(out)[0] + "_loci.tsv", rows)
+		if verbose:
+			print("Combined %s variable sites from %s loci, for %s samples"%(len(sites), len(loci), len(names)))
+		samples = combinedSamples(names, indexes, cols)
+		nsamp, nknown, nblocks = writePhaseInput(out, sites, samples, len(names), verbose, known, block)
+	finally:
+		for index in indexes:
+			index.close()
+	return((nsamp, len(sites), bool(sites.multiallelic().any()), nknown, nfiltered, nblocks))
+
+#Function to get each sample's characters at the variable columns of every
+#locus, joined in locus order (N where the sample is missing from a locus)
+#This is a generator function, yielding (name, characters as uint8, None)
+def combinedSamples(names, indexes, cols):
+	for name in names:
+		chars = list()
+		for index, c in zip(indexes, cols):
+			if name in index:
+				chars.append(np.frombuffer(index.fetch(name).encode("ascii"), dtype=np.uint8)[c])
 			else:
-				types.append("S")
+				chars.append(np.full(len(c), ord("N"), dtype=np.uint8))
+		yield((name, np.concatenate(chars), None))
+
+#Function to convert variants of a VCF (plain or gzip) to a PHASE .inp file
+#Only SNP records within region ("chrom", "chrom:start" or "chrom:start-end")
+#are read, and genotypes are taken from their GT fields, so invariant sequence is
+#never scanned. Sites are called from the genotypes as for a FASTA (records
+#with only one base among the genotypes are dropped), and positions are VCF POS
+#Phased heterozygous genotypes are written in their phased order. A sample has
+#known phase if they are all in one phase set (the PS field, or all genotypes
+#without one); otherwise, with known "file", sites in its largest phase set are
+#marked known (see known for fasta2inp and samplePhase)
+#Other arguments, and the returned tuple, are as for fasta2inp
+def vcf2inp(vcf_file, out, region=None, verbose=True, known=None, filters=None, block=None):
+	if verbose:
+		print("Reading VCF...")
+	positions = list()
+	chars = list()
+	phased = list()
+	swaps = list()
+	sets = list() #phase set of each genotype, or None for records without PS
+	with vcf.vcfReader(vcf_file, region) as reader:
+		names = reader.samples
+		if len(names) == 0:
+			raise ValueError("No samples found in VCF %s"%vcf_file)
+		skipped = 0
+		badcalls = 0 #genotypes with an allele index past the record's alleles
+		for chrom, pos, alleles, (first, second, is_phased), phase_sets in reader:
+			if positions and pos <= positions[-1]:
+				skipped += 1 #PHASE positions must increase
+				continue
+			#Genotypes with an allele index out of range are missing (N)
+			c = vcf.genotype_chars(alleles, first, second)
+			badcalls += np.count_nonzero((first >= len(alleles)) | (second >= len(alleles)))
+			het = GENO_HET[c]
+			#Phased genotypes in the opposite order to GENO_BASE
+			bases = np.frombuffer(b"".join(alleles), dtype=np.uint8)
+			valid = (first >= 0) & (first < len(alleles))
+			swap = is_phased & het & valid & (bases[np.where(valid, first, 0)] != GENO_BASE[0][c])
+			positions.append(pos)
+			chars.append(c)
+			phased.append(is_phased & het)
+			swaps.append(swap)
+			sets.append(phase_sets)
+		skipped += reader.skipped
+	if verbose:
+		print("Read %s SNP records for %s samples (%s other records skipped)"%(len(positions), len(names), skipped))
+		if badcalls:
+			print("Warning: %s genotypes have an allele index with no REF/ALT allele; treated as missing"%badcalls)
 
-		out_fh.write(str(len(locus)))
-		out_fh.write("\n")
-		out_fh.write(str(len(positions))) #write length of polymorphic alignment only
-		out_fh.write("\n")
+	#Samples x records arrays; sites are called as for a FASTA of just these columns
+	shape = (len(names), len(positions))
+	chars = np.ascontiguousarray(np.array(chars, dtype=np.uint8).T).reshape(shape)
+	phased = np.ascontiguousarray(np.array(phased, dtype=bool).T).reshape(shape)
+	swaps = np.ascontiguousarray(np.array(swaps, dtype=bool).T).reshape(shape)
+	if any(s is not None for s in sets):
+		none = np.full(len(names), -1, dtype=np.int64)
+		sets = np.ascontiguousarray(np.array([none if s is None else s for s in sets], dtype=np.int64).T).reshape(shape)
+	else:
+		sets = None
+	alignment = aln.consensAlign(aln.columnProfile.from_array(chars), threshold=1.0, mask=1.0)
+	if verbose:
+		print("Calculating variable columns...")
+	sites, nfiltered = filterSites(alignment, filters, verbose)
+	cols = sites.positions.astype(np.intp)
+	sites = aln.variableSites(np.array(positions, dtype=np.int64)[cols] - 1, sites.codes, sites.counts, sites.missing)
+	samples = ((name, chars[i, cols], samplePhase(phased[i, cols], swaps[i, cols], sets[i, cols] if sets is not None else None)) \
+		for i, name in enumerate(names))
+	nsamp, nknown, nblocks = writePhaseInput(out, sites, samples, len(names), verbose, known, block)
+	return((nsamp, len(sites), bool(sites.multiallelic().any()), nknown, nfiltered, nblocks))
 
-		posline = "P " + " ".join(str(x) for x in positions) + "\n"
-		out_fh.write(posline)
-		out_fh.write(str("".join(types)))
-		out_fh.write("\n")
+#Function to get a sample's phase for writePhaseInput from its phased heterozygous
+#sites, swapped sites and phase sets (None if all phased sites are in one set)
+#Phase is only known within a phase set, so only sites in the set with the most
+#phased sites are kept as phased
+def samplePhase(phased, swap, sets=None):
+	if sets is not None and phased.any():
+		ids, counts = np.unique(sets[phased], return_counts=True)
+		phased = phased & (sets == ids[np.argmax(counts)])
+	return((phased, swap & phased))
 
-		#If there are non-diallelic SNPs, print warning:
-		if "M" in types:
-			print("Warning: There are non-diallelic SNPs in your dataset. PHASE requires these are output in a different format.")
-			print("Coding multi-allelic SNPs as integer: [A=0, G=1, C=2, T=3,N=-1]")
+#Function to write the locus map for combine2inp: for each locus, its FASTA,
+#first and last site in the .inp (1-based), and the offset added to its
+#positions and its alignment length
+def writeLocusMap(path, rows):
+	with open(path, "w") as fh:
+		fh.write("Locus\tFASTA\tFirstSite\tLastSite\tOffset\tLength\n")
+		for row in rows:
+			fh.write("\t".join(str(x) for x in row) + "\n")
 
+#Function to get the variable sites of a catalog passing filters (see fasta2inp)
+#Returns (variableSites, number of sites removed)
+def filterSites(alignment, filters=None, verbose=True):
+	sites = alignment.alnVars
+	nfiltered = 0
+	if filters:
+		keep = sites.filter_mask(alignment.depth, *filters)
+		nfiltered = len(sites) - int(np.count_nonzero(keep))
+		sites = sites[keep]
+		if verbose:
+			print("Removed %s of %s variable sites failing filters."%(nfiltered, len(keep)))
+	return((sites, nfiltered))
+
+#Function to write PHASE input for variableSites, from an iterable of (name,
+#characters at the sites as uint8, phase) for each sample. phase is None, or
+#(phased heterozygous sites, sites phased in the opposite order to GENO_BASE)
+#as bool arrays. depth is the number of samples, and known and block are as for fasta2inp
+#Returns (number of samples written, number with known phase, number of blocks)
+def writePhaseInput(out, sites, samples, depth, verbose=True, known=None, block=None):
+	#For each variable column, create outputs for positions and types
+	#(sites with 3+ bases, i.e. B/D/H/V, are multi-allelic)
+	multi = sites.multiallelic()
+	positions = sites.positions + 1 #add 1 because these are 0-based
+	types = np.where(multi, "M", "S")
+
+	#If there are non-diallelic SNPs, print warning:
+	if multi.any() and verbose:
+		print("Warning: There are non-diallelic SNPs in your dataset. PHASE requires these are output in a different format.")
+		print("Coding multi-allelic SNPs as integer: [A=0, G=1, C=2, T=3,N=-1]")
+
+	#Split sites into overlapping blocks, one .inp each (or one block of all sites)
+	prefix = os.path.splitext(out)[0]
+	writeSiteMap(prefix + "_sites.tsv", sites, types)
+	blocks = siteBlocks(len(sites), *block) if block else [(0, len(sites))]
+	if len(blocks) > 1:
+		width = len(str(len(blocks)))
+		outs = [prefix + "_block" + str(i+1).zfill(width) + ".inp" for i in range(len(blocks))]
+		writeBlockMap(prefix + "_blocks.tsv", blocks, outs, positions)
+		if verbose:
+			print("Splitting %s sites into %s blocks of up to %s sites"%(len(sites), len(blocks), block[0]))
+	else:
+		outs = [out]
+
+	if verbose:
 		print("Expanding sample sequences...")
-		#For each sample, create output lines
-		for samp in locus:
-			line1 = []
-			line2 = []
-			for idx, pos in enumerate(positions):
-				if types[idx] == "M":
-					expand = get_iupac_mult(samp.seq[pos-1]) #convert back to 0-based indexing
-				else:
-					expand = get_iupac_dip(samp.seq[pos-1])
-				line1.append(expand[0])
-				line2.append(expand[1])
-			#Outputs for sample
-			out1 = " ".join(line1) + "\n"
-			out2 = " ".join(line2) + "\n"
-			name = samp.description + "\n"
-			out_fh.write(name)
-			out_fh.write(out1)
-			out_fh.write(out2)
-		print("Done! Output can be found in",params.out)
+	#For each sample, create output lines
+	#Variable columns are mapped through GENO_CELLS at once
+	#With known="hold" the number of samples isn't known until the end, so
+	#genotypes go to temporary files and the headers are added afterwards
+	bodies = [o + ".tmp" if known == "hold" else o for o in outs]
+	known_fh = None
+	known_fhs = list()
+	out_fhs = list()
+	site_offset = np.where(multi, 256, 0)
+	nsamp = 0
+	nknown = 0
+	try:
+		if known == "file":
+			known_fhs = [open(os.path.splitext(o)[0] + "_known.txt", "w") for o in outs]
+		elif known == "hold":
+			known_fh = open(prefix + "_known_pairs", "w")
+		for body, (lo, hi) in zip(bodies, blocks):
+			out_fhs.append(open(body, "wb"))
+			if known != "hold":
+				out_fhs[-1].write(inpHeader(depth, positions[lo:hi], types[lo:hi]))
+		for samp_name, chars, phase in samples:
+			idx = site_offset + chars
+			phased, swap = phase if phase is not None else (None, None)
+			is_known = knownPhase(idx, phased)
+			nknown += int(is_known)
+			if known == "hold" and is_known:
+				#Already phased: write haplotypes with probability 1
+				haps = swapAlleles([GENO_BASE[allele][chars] for allele in (0, 1)], swap)
+				haps = [hap.tobytes().decode("ascii") for hap in haps]
+				known_fh.write("IND: " + samp_name + "\n" + haps[0] + " , " + haps[1] + " , 1.000\n")
+				continue
+			name = samp_name.encode("utf-8") + b"\n"
+			for i, (lo, hi) in enumerate(blocks):
+				if known == "file" and (is_known or phased is None):
+					known_fhs[i].write(("0" if is_known else "*")*(hi-lo) + "\n")
+				elif known == "file":
+					#Phase is unknown only at unphased heterozygous or missing sites
+					unknown = (GENO_HET[idx[lo:hi]] & ~phased[lo:hi]) | ~GENO_CALLED[idx[lo:hi]]
+					known_fhs[i].write(np.where(unknown, ord("*"), ord("0")).astype(np.uint8).tobytes().decode("ascii") + "\n")
+				rows = genotypeRows(chars[lo:hi], site_offset[lo:hi], swap[lo:hi] if swap is not None else None)
+				#Outputs for sample, in one write
+				out_fhs[i].write(name + rows[0] + rows[1])
+			nsamp += 1
+		for fh in out_fhs:
+			fh.close()
+		if known == "hold":
+			for o, body, (lo, hi) in zip(outs, bodies, blocks):
+				with open(o, "wb") as out_fh:
+					out_fh.write(inpHeader(nsamp, positions[lo:hi], types[lo:hi]))
+					with open(body, "rb") as fh:
+						shutil.copyfileobj(fh, out_fh)
+	finally:
+		for fh in out_fhs + known_fhs + [known_fh]:
+			if fh is not None:
+				fh.close()
+		for o, body in zip(outs, bodies):
+			if body != o and os.path.exists(body):
+				os.remove(body)
 
+	if verbose and known:
+		if known == "hold":
+			print("%s of %s samples have known phase, and were written to %s"%(nknown, nsamp+nknown, prefix + "_known_pairs"))
+		else:
+			known_file = os.path.splitext(outs[0])[0] + "_known.txt" if len(outs) == 1 else "each block's _known.txt"
+			print("%s of %s samples have known phase. Give %s to PHASE with -k"%(nknown, nsamp, known_file))
+	if known == "hold" and nsamp == 0 and verbose:
+		print("Warning: All samples have known phase, so there is nothing for PHASE to do.")
+	return((nsamp, nknown, len(blocks)))
+
+#Function to get the .inp header: number of samples, number of sites, positions and types
+def inpHeader(nsamp, positions, types):
+	header = str(nsamp) + "\n"
+	header += str(len(positions)) + "\n" #write length of polymorphic alignment only
+	header += "P " + " ".join(str(x) for x in positions.tolist()) + "\n"
+	header += "".join(types) + "\n"
+	return(header.encode("ascii"))
+
+#Function to write the site map: for each site in the .inp (1-based), its
+#1-based alignment column, PHASE type, bases, diploid A/C/G/T counts and
+#number of samples missing a genotype
+def writeSiteMap(path, sites, types):
+	with open(path, "w") as fh:
+		fh.write("Site\tPosition\tType\tAlleles\tA\tC\tG\tT\tMissing\n")
+		alleles = sites.values()
+		for i in range(len(sites)):
+			row = [i+1, int(sites.positions[i])+1, types[i], alleles[i]]
+			if sites.counts is not None:
+				row.extend(sites.counts[i].tolist() + [int(sites.missing[i])])
+			else:
+				row.extend(["NA"]*5)
+			fh.write("\t".join(str(x) for x in row) + "\n")
+
+#Function to split nsites sites into blocks of size sites, each overlapping the
+#next by at least overlap sites. Returns a list of (first, last+1) site indices
+#The last block is moved back to end at the last site, so all blocks are full size
+def siteBlocks(nsites, size, overlap):
+	if nsites <= size:
+		return([(0, nsites)])
+	nblocks = 2
+	while utils.calculateUnionLengthFixed(nblocks, size, overlap) < nsites:
+		nblocks += 1
+	starts = [i*(size-overlap) for i in range(nblocks-1)] + [nsites-size]
+	return([(start, start+size) for start in starts])
+
+#Function to write the block map: for each block, its .inp file, first and last
+#site (1-based, as in the site map) and first and last alignment column (1-based)
+def writeBlockMap(path, blocks, outs, positions):
+	with open(path, "w") as fh:
+		fh.write("Block\tInput\tFirstSite\tLastSite\tStart\tStop\n")
+		for i, ((lo, hi), o) in enumerate(zip(blocks, outs)):
+			row = [i+1, o, lo+1, hi, positions[lo], positions[hi-1]]
+			fh.write("\t".join(str(x) for x in row) + "\n")
+
+#Function to check if a sample's phase is known: no missing data, and
+#heterozygous at no more than one site, or only at phased sites (if phased is
+#given as a bool array, see samplePhase). idx as for genotypeRows
+def knownPhase(idx, phased=None):
+	if not GENO_CALLED[idx].all():
+		return False
+	het = GENO_HET[idx]
+	if np.count_nonzero(het) <= 1:
+		return True
+	return(phased is not None and not (het & ~phased).any())
+
+#Function to convert a batch of locus FASTAs, spread over a pool of worker processes
+#Writes <out>_<locus>.inp for each locus and a <out>_summary.tsv table
+def runBatch(params):
+	loci = getBatchLoci(params.batch)
+	if len(loci) == 0:
+		sys.exit("No FASTA files found for batch input %s"%params.batch)
+	print("Found %s loci. Converting using %s worker(s)..."%(len(loci), params.threads))
+
+	jobs = [(locus, fas, params.prefix + "_" + locus + ".inp", params.window, params.known, params.filters, params.block) \
+		for locus, fas in loci]
+	if params.threads > 1:
+		import multiprocessing #only needed in batch mode
+		with multiprocessing.Pool(params.threads) as pool:
+			results = list(pool.imap(batchWorker, jobs))
 	else:
-		sys.exit("No input provided.")
+		results = [batchWorker(job) for job in jobs]
+
+	summary = params.prefix + "_summary.tsv"
+	failed = 0
+	with open(summary, "w") as fh:
+		fh.write("Locus\tFASTA\tOutput\tSamples\tSites\tMultiAllelic\tKnownPhase\tFiltered\tBlocks\tStatus\n")
+		for job, res in zip(jobs, results):
+			if res[6] != "OK":
+				failed += 1
+				print("Warning: Locus %s failed: %s"%(job[0], res[6]))
+			fh.write("\t".join(str(x) for x in (job[0], job[1], job[2])) + "\t")
+			fh.write("\t".join(str(x) for x in res) + "\n")
+	print("Done! Converted %s of %s loci. Summary can be found in %s"%(len(loci)-failed, len(loci), summary))
+
+#Worker for runBatch; job is (locus, fasta, out, window, known, filters, block)
+#Returns (samples, sites, multi-allelic, known phase, filtered, blocks, status) so one bad locus doesn't stop the batch
+def batchWorker(job):
+	locus, fas, out, window, known, filters, block = job
+	try:
+		nsamp, nsites, multi, nknown, nfiltered, nblocks = fasta2inp(fas, out, verbose=False, window=window, \
+			known=known, filters=filters, block=block)
+		return((nsamp, nsites, int(multi), nknown, nfiltered, nblocks, "OK"))
+	except Exception as e:
+		return((0, 0, 0, 0, 0, 0, "%s: %s"%(type(e).__name__, e)))
+
+#Function to get a sorted list of (locus, fasta) from a directory, glob, or manifest
+#Manifests list one FASTA per line, optionally followed by a locus name
+def getBatchLoci(batch):
+	loci = list()
+	if os.path.isdir(batch):
+		files = list()
+		for ext in FASTA_EXTENSIONS:
+			files.extend(glob.glob(os.path.join(batch, "*" + ext)))
+	elif os.path.isfile(batch):
+		with open(batch, "r") as fh:
+			for line in fh:
+				line = line.strip()
+				if not line or line[0] == "#":
+					continue
+				stuff = line.split()
+				if len(stuff) > 1:
+					loci.append((stuff[1], stuff[0]))
+				else:
+					loci.append((locusName(stuff[0]), stuff[0]))
+		return(loci)
+	else:
+		files = glob.glob(batch)
+	for fas in sorted(files):
+		loci.append((locusName(fas), fas))
+	return(loci)
+
+#Function to get a locus name from a FASTA path (file name without extension)
+def locusName(fas):
+	return(os.path.splitext(os.path.basename(fas))[0])
 
 
 #Object to parse command-line arguments
@@ -86,15 +531,37 @@ class parseArgs():
 	def __init__(self):
 		#Define options
 		try:
-			options, remainder = getopt.getopt(sys.argv[1:], 'f:o:h', \
-			["fasta=","out=","help"])
+			options, remainder = getopt.getopt(sys.argv[1:], 'f:o:hb:t:w:k:m:x:Bn:l:c:v:r:', \
+			["fasta=","out=","help","batch=","threads=","window=","known=","mac=","maxmiss=","biallelic","block=","overlap=", \
+			"combine=","vcf=","region="])
 		except getopt.GetoptError as err:
 			print(err)
 			self.display_help("\nExiting because getopt returned non-zero exit status.")
 		#Default values for params
 		#Input params
 		self.fasta=None
+		self.vcf=None
+		self.region=None
 		self.out=None
+		self.prefix=None
+		self.window=None
+		self.known=None
+
+		#Site filters
+		self.mac=0
+		self.maxmiss=1.0
+		self.biallelic=False
+		self.filters=None
+
+		#Block params
+		self.nsites=None
+		self.overlap=None
+		self.block=None
+
+		#Batch params
+		self.batch=None
+		self.threads=1
+		self.combine=None
 
 		#First pass to see if help menu was called
 		for o, a in options:
@@ -113,16 +580,66 @@ class parseArgs():
 				pass
 			elif opt in ('o','out'):
 				self.out = arg
+			elif opt in ('v','vcf'):
+				self.vcf = arg
+			elif opt in ('r','region'):
+				self.region = arg
+			elif opt in ('b','batch'):
+				self.batch = arg
+			elif opt in ('c','combine'):
+				self.combine = arg
+			elif opt in ('t','threads'):
+				self.threads = int(arg)
+			elif opt in ('w','window'):
+				self.window = int(arg)
+			elif opt in ('k','known'):
+				self.known = arg.lower()
+			elif opt in ('m','mac'):
+				self.mac = int(arg)
+			elif opt in ('x','maxmiss'):
+				self.maxmiss = float(arg)
+			elif opt in ('B','biallelic'):
+				self.biallelic = True
+			elif opt in ('n','block'):
+				self.nsites = int(arg)
+			elif opt in ('l','overlap'):
+				self.overlap = int(arg)
 			else:
 				assert False, "Unhandled option %r"%opt
 
 		#Check manditory options are set
-		if not self.fasta:
-			self.display_help("Error: Missing required input file (-f,--fasta).")
+		if not self.fasta and not self.batch and not self.combine and not self.vcf:
+			self.display_help("Error: Missing required input file (-f,--fasta, -v,--vcf, -b,--batch or -c,--combine).")
+		if len([x for x in (self.fasta, self.vcf, self.batch, self.combine) if x]) > 1:
+			self.display_help("Error: Only one of -f,--fasta, -v,--vcf, -b,--batch and -c,--combine can be used.")
+		if self.region and not self.vcf:
+			self.display_help("Error: Region (-r,--region) can only be used with -v,--vcf.")
+		if self.threads < 1:
+			self.display_help("Error: Number of threads (-t,--threads) must be at least 1.")
+		if self.known and self.known not in KNOWN_MODES:
+			self.display_help("Error: Known phase mode (-k,--known) must be one of: %s"%", ".join(KNOWN_MODES))
+		if self.window is not None and self.window < 1:
+			self.display_help("Error: Window width (-w,--window) must be at least 1.")
+		if self.maxmiss < 0.0 or self.maxmiss > 1.0:
+			self.display_help("Error: Maximum proportion missing (-x,--maxmiss) must be between 0 and 1.")
+		if self.mac > 0 or self.maxmiss < 1.0 or self.biallelic:
+			self.filters = (self.mac, self.maxmiss, self.biallelic)
+		if self.nsites is not None:
+			if self.overlap is None:
+				self.overlap = self.nsites // 4
+			if self.nsites < 2:
+				self.display_help("Error: Sites per block (-n,--block) must be at least 2.")
+			if self.overlap < 1 or self.overlap >= self.nsites:
+				self.display_help("Error: Block overlap (-l,--overlap) must be at least 1, and less than -n.")
+			self.block = (self.nsites, self.overlap)
+		elif self.overlap is not None:
+			self.display_help("Error: Block overlap (-l,--overlap) requires -n,--block.")
 
 		if self.out:
+			self.prefix = self.out
 			self.out = self.out + ".inp"
 		else:
+			self.prefix = "out"
 			self.out = "out.inp"
 
 
@@ -132,98 +649,136 @@ class parseArgs():
 			print (message)
 		print ("\nfasta2phase.py\n")
 		print ("Contact:Tyler K. Chafin, University of Arkansas,tkchafin@uark.edu")
-		print ("\nUsage: ", sys.argv[0], "-f </path/to/fasta  <-o out_prefix>\n")
+		print ("\nUsage: ", sys.argv[0], "-f </path/to/fasta  <-o out_prefix>")
+		print ("       ", sys.argv[0], "-v </path/to/vcf[.gz]  <-r chrom:start-end> <-o out_prefix>")
+		print ("       ", sys.argv[0], "-b <dir, 'glob', or manifest>  <-t threads> <-o out_prefix>")
+		print ("       ", sys.argv[0], "-c <dir, 'glob', or manifest>  <-o out_prefix>\n")
 		print ("Description: Formats a FASTA sequence alignment for haplotype reconstruction in PHASE2")
 
 		print("""
 	Input options:
 		-f,--fasta	: FASTA file with one consensus sequencer per infividual
 		-o,--out	: Prefix for output file <default = ./out>
-		-h,--help	: Displays help menu""")
+		-w,--window	: Find variable sites in windows of this many columns, to bound
+			  memory for very long alignments <default = whole alignment>
+		-k,--known	: How to handle samples with known phase (no missing data and
+			  heterozygous at no more than one site) <default = send to PHASE as usual>
+			--file: Also write <out_prefix>_known.txt, to give to PHASE with -k
+			--hold: Leave them out of the .inp, and write their haplotypes to
+			  <out_prefix>_known_pairs (merge back with parsePairs.py -k)
+		-h,--help	: Displays help menu
+
+	VCF input:
+		-v,--vcf	: VCF file (plain or gzip) to use instead of a FASTA. Only SNP records
+			  are read, with genotypes from GT. Phased genotypes are kept in order,
+			  and count as known phase (see -k)
+		-r,--region	: Only read records in a region: chrom, chrom:start, or chrom:start-end
+			  (1-based, inclusive). Required if the VCF has more than one chromosome
+
+	Site filters:
+	--Sites failing these are left out of the .inp. Retained sites are listed with
+	--their alignment columns in <out_prefix>_sites.tsv (give to parsePairs.py -s)
+		-m,--mac	: Minimum minor allele count (diploid; e.g. 2 drops singletons) <default = 0>
+		-x,--maxmiss	: Maximum proportion of samples with missing genotype (N, gap,
+			  or 3-base code) <default = 1.0>
+		-B,--biallelic	: Only keep sites with two bases (drops multi-allelic B/D/H/V sites)
+
+	Blocks:
+	--Split long loci into overlapping blocks of sites, to run in parallel in PHASE.
+	--Writes <out_prefix>_block<i>.inp per block, and <out_prefix>_blocks.tsv
+	--(give to parsePairs.py -l, to stitch block haplotypes back together)
+		-n,--block	: Number of variable sites per block <default = all in one .inp>
+		-l,--overlap	: Number of sites shared by neighbouring blocks <default = 1/4 of -n>
+
+	Batch options:
+		-b,--batch	: Directory of FASTA files, quoted glob (e.g. 'loci/*.fasta'),
+			  or manifest file listing one FASTA per line (optional 2nd column: locus name)
+			--Writes <out_prefix>_<locus>.inp per locus and <out_prefix>_summary.tsv
+		-t,--threads	: Number of worker processes for batch mode <default = 1>
+
+	Multi-locus options:
+		-c,--combine	: Directory of FASTA files, quoted glob, or manifest (as for -b) of
+			  loci sharing samples, to write to one .inp. Samples are matched by name,
+			  and each locus's positions are offset by the length of the loci before it
+			--Writes <out_prefix>.inp and <out_prefix>_loci.tsv (give to parsePairs.py -L)""")
 		print()
 		sys.exit()
 
 #Function to split character to IUPAC codes, assuming diploidy
 def get_iupac_dip(char):
-	lower = False
-	iupac = {
-		"A"	: ["A","A"],
-		"G"	: ["G","G"],
-		"C"	: ["C","C"],
-		"T"	: ["T","T"],
-		"N"	: ["?","?"],
-		"-"	: ["?","?"],
-		"R"	: ["A","G"],
-		"Y"	: ["C","T"],
-		"S"	: ["G","C"],
-		"W"	: ["A","T"],
-		"K"	: ["G","T"],
-		"M"	: ["A","C"],
-		"B"	: ["?","?"],
-		"D"	: ["?","?"],
-		"H"	: ["?","?"],
-		"V"	: ["?","?"]
-	}
-	ret = iupac[char]
-	return ret
+	return IUPAC_DIP[char]
 
 #Function to split character to IUPAC codes, assuming diploidy
 def get_iupac_mult(char):
-	lower = False
-	iupac = {
-		"A"	: ["0","0"],
-		"G"	: ["1","1"],
-		"C"	: ["2","2"],
-		"T"	: ["3","3"],
-		"N"	: ["-1","-1"],
-		"-"	: ["-1","-1"],
-		"R"	: ["0","1"],
-		"Y"	: ["2","3"],
-		"S"	: ["1","2"],
-		"W"	: ["0","3"],
-		"K"	: ["1","3"],
-		"M"	: ["0","2"],
-		"B"	: ["-1","-1"],
-		"D"	: ["-1","-1"],
-		"H"	: ["-1","-1"],
-		"V"	: ["-1","-1"]
-	}
-	ret = iupac[char]
-	return ret
-
-#Read genome as FASTA. FASTA header will be used
-#This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
-	if not fileCheck(fas):
-		raise FileNotFoundError("Fatal exception, file %s not found."%fas)
-
-	fh = open(fas)
-	try:
-		with fh as file_object:
-			contig = ""
-			seq = ""
-			for line in file_object:
-				line = line.strip()
-				if not line:
-					continue
-				#print(line)
-				if line[0] == ">": #Found a header line
-					#If we already loaded a contig, yield that contig and
-					#start loading a new one
-					if contig:
-						yield([contig,seq]) #yield
-						contig = "" #reset contig and seq
-						seq = ""
-					split_line = line.split()
-					contig = (split_line[0].replace(">",""))
-				else:
-					seq += line
-		#Iyield last sequence, if it has both a header and sequence
-		if contig and seq:
-			yield([contig,seq])
-	finally:
-		fh.close()
+	return IUPAC_MULT[char]
+
+#Function to build lookup tables of PHASE genotype tokens from IUPAC_DIP and
+#IUPAC_MULT, indexed by [allele (0/1), site type (0=S, 1=M)*256 + ASCII character]
+#Each entry is the token followed by a space, zero-padded to 4 bytes and
+#stored as one uint32 (e.g. "A \0\0", "-1 \0"), so a row is one take()
+#Also returns the same table as uint16 for rows with no 2-character tokens,
+#and a flag for which entries are 2-character tokens (i.e. "-1")
+def buildGenotypeTables():
+	cells = np.zeros((2, 512, 4), dtype=np.uint8)
+	for site_type, table in enumerate((IUPAC_DIP, IUPAC_MULT)):
+		for char, alleles in table.items():
+			for c in (char, char.lower()):
+				for allele in (0, 1):
+					tok = (alleles[allele] + " ").encode("ascii")
+					cells[allele, site_type*256 + ord(c), :len(tok)] = list(tok)
+	wide = (cells[0, :, 2] != 0) | (cells[1, :, 2] != 0)
+	narrow = np.ascontiguousarray(cells[..., :2]).view(np.uint16)[..., 0]
+	return(np.ascontiguousarray(cells.view(np.uint32)[..., 0]), np.ascontiguousarray(narrow), wide)
+
+GENO_CELLS, GENO_NARROW, GENO_WIDE = buildGenotypeTables()
+
+#Function to build lookup tables for finding samples with known phase,
+#indexed as for GENO_CELLS: whether a genotype is called (not missing),
+#whether it is heterozygous, and the base of each allele (from IUPAC_DIP)
+def buildKnownTables():
+	called = np.zeros(512, dtype=bool)
+	het = np.zeros(512, dtype=bool)
+	bases = np.full((2, 256), ord("?"), dtype=np.uint8)
+	for site_type, table in enumerate((IUPAC_DIP, IUPAC_MULT)):
+		for char, alleles in table.items():
+			for c in (char, char.lower()):
+				called[site_type*256 + ord(c)] = alleles[0] not in ("?", "-1")
+				het[site_type*256 + ord(c)] = alleles[0] != alleles[1]
+				if site_type == 0:
+					for allele in (0, 1):
+						bases[allele, ord(c)] = ord(alleles[allele])
+	return(called, het, bases)
+
+GENO_CALLED, GENO_HET, GENO_BASE = buildKnownTables()
+
+#Function to render the two PHASE genotype rows for a sample, as bytes
+#chars are the sample's characters (uint8) at the variable sites, and
+#site_offset is 0 (S) or 256 (M) for each site
+#If swap (bool array) is given, the two alleles are swapped at those sites
+def genotypeRows(chars, site_offset, swap=None):
+	if len(chars) == 0:
+		return([b"\n", b"\n"])
+	idx = site_offset + chars
+	rows = list()
+	#Every token is one character: fixed 2-byte cells
+	if not GENO_WIDE[idx].any():
+		for cells in swapAlleles([GENO_NARROW[allele].take(idx) for allele in (0, 1)], swap):
+			row = cells.view(np.uint8)
+			row[-1] = ord("\n") #replace the trailing space
+			rows.append(row.tobytes())
+		return(rows)
+	for cells in swapAlleles([GENO_CELLS[allele].take(idx) for allele in (0, 1)], swap):
+		flat = cells.view(np.uint8)
+		row = flat[flat != 0] #drop the zero padding
+		row[-1] = ord("\n")
+		rows.append(row.tobytes())
+	return(rows)
+
+#Function to swap a pair of per-site arrays at sites where swap is True
+def swapAlleles(pair, swap=None):
+	if swap is None or not swap.any():
+		return(pair)
+	return([np.where(swap, pair[1], pair[0]), np.where(swap, pair[0], pair[1])])
 
 #Function to check if a file path is valid
 def fileCheck(f):
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+import sys
+import os
+import mmap
+
+#Bytes read at a time by read_fasta
+CHUNK_SIZE = 1 << 18
+
+#bytes.translate tables used by read_fasta
+_WHITESPACE = b" \t\r\n\x0b\x0c"
+_UPPER = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+############################# CLASSES ##################################
+
+class fastaIndex():
+	'Random access to FASTA records by name, using a samtools-style .fai index'
+	#Default constructor
+	#Index is read from <fasta>.fai if it is up to date, otherwise built and saved
+	#Sequence names must be unique (ValueError otherwise)
+	def __init__(self, fas, index=None):
+		if not os.path.isfile(fas):
+			raise FileNotFoundError("File %s not found!"%fas)
+		self.fasta = fas
+		self.index_file = index if index else fas + ".fai"
+		self.names = [] #record names, in file order
+		self.records = dict() #name -> [length, offset, linebases, linewidth]
+		if index_is_current(fas, self.index_file):
+			self._read_index()
+		else:
+			self._build_index()
+			self._write_index()
+		self._fh = open(fas, "rb")
+		self._mm = None
+		if os.path.getsize(fas) > 0:
+			self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, name):
+		return name in self.records
+
+	def __iter__(self):
+		for name in self.names:
+			yield([name, self.fetch(name)])
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if self._mm is not None:
+			self._mm.close()
+			self._mm = None
+		self._fh.close()
+
+	#Returns the length of a record
+	def length(self, name):
+		return self.records[name][0]
+
+	#Returns sequence (or 0-based, end-exclusive substring) of a record by name
+	def fetch(self, name, start=0, end=None):
+		length, offset, linebases, linewidth = self.records[name]
+		if end is None or end > length:
+			end = length
+		if start >= end:
+			return("")
+		first = offset + (start // linebases)*linewidth + (start % linebases)
+		last = offset + (end // linebases)*linewidth + (end % linebases)
+		raw = self._mm[first:last]
+		return(raw.replace(b"\n", b"").replace(b"\r", b"").decode("ascii"))
+
+	#Scan the FASTA once to get offsets and line widths of each record
+	def _build_index(self):
+		self.names = []
+		self.records = dict()
+		name = None
+		pos = 0
+		with open(self.fasta, "rb") as fh:
+			for line in fh:
+				nbytes = len(line)
+				stripped = line.rstrip(b"\r\n")
+				if stripped[:1] == b">":
+					if name is not None:
+						self._add_record(name, rec)
+					name = stripped.split()[0].replace(b">", b"").decode("ascii")
+					rec = [0, pos + nbytes, 0, 0]
+					short = False #True once a short (i.e. last) line is seen
+				elif name is not None and stripped:
+					if rec[2] == 0:
+						rec[2] = len(stripped)
+						rec[3] = nbytes
+					elif short or len(stripped) > rec[2]:
+						raise ValueError("Sequence %s in %s has inconsistent line lengths, can't be indexed"%(name, self.fasta))
+					if len(stripped) < rec[2]:
+						short = True
+					rec[0] += len(stripped)
+				elif name is not None and rec[0] > 0:
+					#Blank line ends the sequence; only more blank lines may follow
+					short = True
+				pos += nbytes
+		if name is not None:
+			self._add_record(name, rec)
+
+	def _add_record(self, name, rec):
+		if rec[0] == 0:
+			return
+		if rec[2] == 0:
+			rec[2] = rec[3] = 1
+		if name in self.records:
+			raise ValueError("Duplicate sequence %s in %s, can't be indexed"%(name, self.fasta))
+		self.names.append(name)
+		self.records[name] = rec
+
+	def _read_index(self):
+		with open(self.index_file, "r") as fh:
+			for line in fh:
+				stuff = line.split()
+				if len(stuff) < 5:
+					continue
+				if stuff[0] in self.records:
+					raise ValueError("Duplicate sequence %s in index %s"%(stuff[0], self.index_file))
+				self.names.append(stuff[0])
+				self.records[stuff[0]] = [int(x) for x in stuff[1:5]]
+
+	#Save index next to the FASTA; not fatal if the directory is read-only
+	def _write_index(self):
+		try:
+			with open(self.index_file, "w") as fh:
+				for name in self.names:
+					fh.write(name + "\t" + "\t".join(str(x) for x in self.records[name]) + "\n")
+		except OSError as e:
+			print("Warning: Could not write FASTA index %s: %s"%(self.index_file, e))
+
+
+######################## STATIC FUNCTIONS ##############################
+
+#Read genome as FASTA. FASTA header will be used
+#This is a generator function
+#Doesn't matter if sequences are interleaved or not.
+#File is read in large binary chunks, and record starts are found with
+#bytes.find (memchr) instead of testing every line. Sequence lines are
+#joined with bytes.replace/ b"".join, and whitespace is removed (optionally
+#upper-casing) with bytes.translate
+def read_fasta(fas, upper=False, chunk_size=CHUNK_SIZE):
+	if not os.path.exists(fas):
+		raise FileNotFoundError("File %s not found!"%fas)
+
+	table = _UPPER if upper else None
+	with open(fas, 'rb') as fh:
+		try:
+			parts = list() #pieces of a record continued from earlier chunks
+			last = None #last complete record, held back (see parse_record)
+			newline = True #True if the previous chunk ended a line
+			dirty = False #True if current record may hold tabs/ carriage returns
+			started = False #False until the first header is found
+			while True:
+				data = fh.read(chunk_size)
+				if not data:
+					break
+				chunk_dirty = has_extra_whitespace(data)
+				dirty = dirty or chunk_dirty
+				pos = 0 #start of the record in progress within data
+				found = data.find(62) #">"
+				while found >= 0:
+					#Only a ">" at the start of a line begins a record
+					if (found > 0 and data[found-1] == 10) or (found == 0 and newline):
+						if parts:
+							parts.append(data[:found])
+							rec = parse_record(b"".join(parts), 0, None, table, dirty)
+							parts = list()
+						elif found > pos:
+							rec = parse_record(data, pos, found, table, dirty)
+						else:
+							rec = None
+						if rec is not None:
+							if last is not None:
+								yield(last)
+							last = rec
+						pos = found
+						started = True
+						dirty = chunk_dirty
+					found = data.find(62, found+1)
+				if started:
+					parts.append(data[pos:])
+				newline = data[-1:] == b"\n"
+			if parts:
+				rec = parse_record(b"".join(parts), 0, None, table, dirty)
+				if rec is not None:
+					if last is not None:
+						yield(last)
+					last = rec
+			#yield last sequence, if it has both a header and sequence
+			if last is not None and last[1]:
+				yield(last)
+		except IOError:
+			print("Could not read file ",fas)
+			sys.exit(1)
+
+#Function to parse one raw FASTA record from buf[start:end] into [name, seq]
+#The record must start with the ">" header line. Returns None otherwise, or
+#if the header has no name.
+#Records without sequence are kept, except at the end of the file (as the
+#line-based reader always did), so read_fasta holds one record back
+#If dirty is False the caller has checked there are no tabs/ carriage returns
+def parse_record(buf, start=0, end=None, table=None, dirty=True):
+	if end is None:
+		end = len(buf)
+	if start >= end or buf[start] != 62: #">"
+		return None
+	header_end = buf.find(10, start, end) #"\n"
+	if header_end < 0:
+		header_end = end
+	words = buf[start:header_end].split(None, 1)
+	name = words[0].replace(b">", b"").decode("utf-8") if words else ""
+	if not name:
+		return None
+	#Drop the final line break so unwrapped records need no further copies
+	if end > header_end and buf[end-1] == 10:
+		end -= 1
+	#Line breaks are dropped with bytes.replace (memchr-fast); the slower
+	#per-byte translate is only needed for other whitespace or upper-casing
+	seq = buf[header_end+1:end].replace(b"\n", b"")
+	if 32 in seq or (dirty and has_extra_whitespace(seq)):
+		seq = seq.translate(None, _WHITESPACE)
+	if table is not None:
+		seq = seq.translate(table)
+	return([name, seq.decode("utf-8")])
+
+#Function to check for whitespace other than spaces and line feeds
+#(testing ints rather than 1-byte strings lets Python use memchr)
+def has_extra_whitespace(data):
+	return(13 in data or 9 in data or 11 in data or 12 in data)
+
+#Function to check if an index file exists, is newer than its FASTA, and fits
+#its size: the last record in the index must end where the FASTA does (only
+#whitespace after it), so a FASTA replaced keeping an old mtime (e.g. cp -p) is
+#re-indexed unless it is the same size
+def index_is_current(fas, index, max_tail=4096):
+	if not os.path.isfile(index):
+		return False
+	if os.path.getmtime(index) < os.path.getmtime(fas):
+		return False
+	last = None
+	with open(index, "r") as fh:
+		for line in fh:
+			stuff = line.split()
+			if len(stuff) >= 5:
+				last = [int(x) for x in stuff[1:5]]
+	if last is None:
+		return False
+	length, offset, linebases, linewidth = last
+	end = offset + (length // linebases)*linewidth + (length % linebases)
+	size = os.path.getsize(fas)
+	if end > size or size - end > max_tail:
+		return False
+	with open(fas, "rb") as fh:
+		fh.seek(end)
+		return fh.read().translate(None, _WHITESPACE) == b""
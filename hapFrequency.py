@@ -4,210 +4,197 @@ import re
 import sys
 import os
 import getopt
-import Bio
+import glob
+import numpy as np
 import alignment_tools as aln
-from Bio import AlignIO
+import haplotype_tools as hapt
+from fasta_tools import read_fasta
 
 def main():
 	params = parseArgs()
 
-	#Now, get the alignment from the FASTA file (as another dict)
-	if params.fasta:
-		pop_assign = dict()
-		seqs = dict()
-		#print('Reading alignment from FASTA...')
+	#If partial count files to merge provided:
+	if params.merge:
+		parts = getPartialFiles(params.merge)
+		table = mergePartials(parts)
+		print("Merged", len(parts), "partial count files")
 
-		#check if there is a certain way user wants haps to be coded
-		coding=dict()
-		if params.code_table:
-			coding=parsePopmap(params.code_table)
-
-		for f in read_fasta(params.fasta):
-			if params.code_table and coding[f[1]]:
-				seqs[f[0]] = coding[f[1]]
-			else:
-				seqs[f[0]] = f[1]
-
-		if params.dip:
-			#parse fasta list to conjoin haplotypes
-			seqs = conjoinDiplotypes(seqs)
-
-
-		#parse popmap file for dictionary of sample assignments
-		if params.popmap:
-			#print("Parsing popmap file...")
-			pop_assign = parsePopmap(params.popmap)
-			print("Found", len(pop_assign),"samples in popmap")
-		# with open("test.popmap", "w") as f:
-		# 	for key, val in pop_assign.items():
-		# 		line = key + "\t" + val + "\n"
-		# 		f.write(line)
-		# 	f.close()
-
-		#Make dict of lists representing populations
-		pops = dict()
-		pops["TOTAL"]=(list(seqs.values()))
-
-		if params.popmap:
-			allpops=list()
-			for samp in seqs:
-				if samp in pop_assign:
-					if pop_assign[samp] in pops:
-						pops[pop_assign[samp]].append(seqs[samp])
-					else:
-						t = list()
-						t.append(seqs[samp])
-						#print("adding", pop_assign[samp],"to dict")
-						pops[pop_assign[samp]]=t
-					allpops.append(seqs[samp])
-				else:
-					print("Warning: Sample %s isn't in popmap."%samp)
-			pops["ALLPOPS"]=allpops
-
-		#Grab table contents
-		hapTotals = dict()
-		hapCounts = dict()
-		for hap in pops["TOTAL"]:
-			hapTotals[hap] = dict()
-			hapCounts[hap] = dict()
-		#Now, parse pops to get frequencies
-		for pop in pops:
-			print("pop")
-			counts = dict()
-			total = 0
-			for hap in pops[pop]:
-				total = total + 1
-				if hap in counts:
-					counts[hap] = counts[hap]+1
-				else:
-					counts[hap]=1
-			print("Haplotype frequencies for pop %s:"%pop)
-			for key in counts:
-				f = float(counts[key])/float(total)
-				print("%s:%s"%(key,("{0:.4f}".format(f))))
-				hapTotals[key][pop] = f
-				hapCounts[key][pop] = counts[key]
-			print()
-
-
-		#Write table
-		with open(params.out, 'w') as fh:
-			try:
-				popOrder = pops.keys()
-				header = "Haplotype"
-				if params.dip:
-					header="Diplotype"
-
-				for p in popOrder:
-					header = header + "\t" + str(p)
-				header = header + "\n"
-				fh.write(header)
-
-				#Print haplotype line
-				for hap in hapTotals:
-					hapLine = str(hap)
-					for p in popOrder:
-						if p in hapTotals[hap]:
-							hapLine = hapLine + "\t" + str(("{0:.4f}".format(hapTotals[hap][p])))
-						else:
-							hapLine = hapLine + "\t" + str(0.0000)
-					hapLine = hapLine + "\n"
-					fh.write(hapLine)
-			except IOError:
-				print("Could not read file ",fh)
-				sys.exit(1)
-			finally:
-				fh.close()
-
-			#write counts table
-			with open(params.out2, 'w') as fh:
-				try:
-					popOrder = pops.keys()
-					header = "Haplotype"
-					if params.dip:
-						header="Diplotype"
-
-					for p in popOrder:
-						header = header + "\t" + str(p)
-					header = header + "\n"
-					fh.write(header)
-
-					#Print haplotype line
-					for hap in hapTotals:
-						hapLine = str(hap)
-						for p in popOrder:
-							if p in hapTotals[hap]:
-								hapLine = hapLine + "\t" + str(hapCounts[hap][p])
-							else:
-								hapLine = hapLine + "\t" + str(0)
-						hapLine = hapLine + "\n"
-						fh.write(hapLine)
-				except IOError:
-					print("Could not read file ",fh)
-					sys.exit(1)
-				finally:
-					fh.close()
+	#If fasta provided:
+	elif params.fasta:
+		table = countHaplotypes(params)
 
 	else:
 		print("No input provided")
 		sys.exit(1)
 
+	if params.partial:
+		table.save(params.partial)
+		print("Partial counts can be found in", params.partial)
+
+	#Columns are TOTAL (all samples), then each population and ALLPOPS
+	#(samples in the popmap), if a popmap was given
+	popOrder = ["TOTAL"]
+	counts = table.totals[:, None]
+	if table.grouped:
+		popOrder = popOrder + table.pops + ["ALLPOPS"]
+		counts = np.column_stack((counts, table.counts, table.counts.sum(axis=1)))
+	freqs = hapt.count_frequencies(counts)
+
+	for j, pop in enumerate(popOrder):
+		print("Haplotype frequencies for pop %s:"%pop)
+		for i in np.flatnonzero(counts[:, j]):
+			print("%s:%s"%(table.labels[i],("{0:.4f}".format(freqs[i, j]))))
+		print()
 
-
-#Read genome as FASTA. FASTA header will be used
+	#Write tables
+	header = "Diplotype" if table.dip else "Haplotype"
+	writeTable(params.out, header, popOrder, table.labels, counts, freqs)
+	writeTable(params.out2, header, popOrder, table.labels, counts)
+	if params.reps:
+		writeRepresentatives(params.reps, table.digests, table.reps, table.dip)
+		print("Wrote", len(table), "representative sequences to", params.reps)
+
+#Function to count haplotypes (or diplotypes) in each population from a FASTA file
+#Returns a hapTable
+def countHaplotypes(params):
+	pop_assign = dict()
+
+	#check if there is a certain way user wants haps to be coded
+	coding=dict()
+	if params.code_table:
+		coding=parsePopmap(params.code_table)
+
+	#parse popmap file for dictionary of sample assignments
+	if params.popmap:
+		#print("Parsing popmap file...")
+		pop_assign = parsePopmap(params.popmap)
+		print("Found", len(pop_assign),"samples in popmap")
+
+	#Count haplotypes as they are read. Each is keyed by a digest of its
+	#sequence (or code), and only the first sequence with each digest is
+	#kept, so memory grows with the number of distinct haplotypes
+	counter = hapt.hapCounts()
+	labels = list() #packed sequence (or code) to report, by haplotype ID
+	reps = list() #packed representative sequence if not the label, by haplotype ID
+	records = readHaplotypes(params.fasta, coding)
+	if params.dip:
+		#Pair _A and _B haplotypes as they are read; samples keep the _A
+		#name, to ensure they match the popmap
+		pairs = hapt.hapPairs(records, params.pending)
+		records = pairs
+	for samp, key, seq in records:
+		if params.popmap and samp not in pop_assign:
+			print("Warning: Sample %s isn't in popmap."%samp)
+		i = counter.add(hapt.hap_digest(key), pop_assign.get(samp))
+		if i == len(labels):
+			labels.append(packHap(key))
+			reps.append(None if key == seq else packHap(seq))
+
+	if params.dip:
+		print("Found", pairs.pairs, "diplotypes")
+		if pairs.unpaired:
+			print("Warning:", len(pairs.unpaired), "haplotypes could not be paired; see", params.unpaired)
+		writeUnpaired(params.unpaired, pairs.unpaired)
+
+	labels = [unpackHap(h) for h in labels]
+	reps = [label if rep is None else unpackHap(rep) for label, rep in zip(labels, reps)]
+	return(counter.table(labels, reps, dip=params.dip, grouped=bool(params.popmap)))
+
+#Function to merge partial count files (from -s) into one hapTable
+def mergePartials(parts):
+	table = None
+	for part in parts:
+		try:
+			other = hapt.hapTable.load(part)
+		except (OSError, ValueError, KeyError) as e:
+			print("Error: Can't read partial counts from %s: %s"%(part, e))
+			sys.exit(1)
+		if table is None:
+			table = other
+			continue
+		try:
+			table.merge(other)
+		except ValueError as e:
+			print("Error: Can't merge %s: %s"%(part, e))
+			sys.exit(1)
+	return(table)
+
+#Function to get the list of partial count files, from a comma-separated
+#list of files and/or quoted globs (glob matches are sorted by name)
+def getPartialFiles(parts):
+	files = list()
+	for p in parts.split(","):
+		matches = sorted(glob.glob(p))
+		files.extend(matches if matches else [p])
+	return(files)
+
+#Function to read (sample, key, sequence) for each haplotype in a FASTA file
 #This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
+#key is the haplotype's code from the coding table, if it has one, otherwise
+#its sequence
+def readHaplotypes(fasta, coding):
+	for f in read_fasta(fasta):
+		if coding and coding[f[1]]:
+			yield((f[0], coding[f[1]], f[1]))
+		else:
+			yield((f[0], f[1], f[1]))
 
-	if os.path.exists(fas):
-		with open(fas, 'r') as fh:
-			try:
-				contig = ""
-				seq = ""
-				for line in fh:
-					line = line.strip()
-					if not line:
-						continue
-					#print(line)
-					if line[0] == ">": #Found a header line
-						#If we already loaded a contig, yield that contig and
-						#start loading a new one
-						if contig:
-							yield([contig,seq]) #yield
-							contig = "" #reset contig and seq
-							seq = ""
-						split_line = line.split()
-						contig = (split_line[0].replace(">",""))
-					else:
-						seq += line
-				#Iyield last sequence, if it has both a header and sequence
-				if contig and seq:
-					yield([contig,seq])
-			except IOError:
-				print("Could not read file ",fas)
-				sys.exit(1)
-			finally:
-				fh.close()
-	else:
-		raise FileNotFoundError("File %s not found!"%fas)
-
-
-#function joins diplotypes from a sequence list where paired haps end with _A and _B
-#note: samples will retain the _A name, to ensure they match the popmap
-def conjoinDiplotypes(haps):
-	dips=dict()
-	for name, seq in haps.items():
-		if "_A" in name:
-			paired=name.replace("_A", "_B")
-			if haps[paired]:
-				print(name, "=", seq,"/",haps[paired])
-				if seq < haps[paired]:
-					dips[name] = seq + "/" + haps[paired]
+#Function to write haplotypes that couldn't be paired into diplotypes
+def writeUnpaired(out, unpaired):
+	with open(out, 'w') as fh:
+		try:
+			fh.write("Sample\tReason\n")
+			for name, reason in unpaired:
+				fh.write(name + "\t" + reason + "\n")
+		except IOError:
+			print("Could not read file ",fh)
+			sys.exit(1)
+
+#Function to write one representative sequence per haplotype, named by its
+#digest (as hex); diplotypes are written as <digest>_A and <digest>_B
+def writeRepresentatives(out, digests, reps, dip=False):
+	with open(out, 'w') as fh:
+		try:
+			for digest, seq in zip(digests, reps):
+				if dip:
+					hapA, hapB = seq.split("/")
+					fh.write(">" + digest.hex() + "_A\n" + hapA + "\n")
+					fh.write(">" + digest.hex() + "_B\n" + hapB + "\n")
 				else:
-					dips[name] = haps[paired] + "/" + seq
-			else:
-				print("Skipping sample: Haplotype",name,"has no pair! Should be:",paired)
-	return(dips)
+					fh.write(">" + digest.hex() + "\n" + seq + "\n")
+		except IOError:
+			print("Could not read file ",fh)
+			sys.exit(1)
+
+#Function to write a table of haplotypes (rows) by populations (columns)
+#Writes frequencies if given, otherwise counts; cells with no samples are 0
+def writeTable(out, header, popOrder, labels, counts, freqs=None):
+	with open(out, 'w') as fh:
+		try:
+			fh.write(header + "\t" + "\t".join(str(p) for p in popOrder) + "\n")
+			for i, label in enumerate(labels):
+				if freqs is None:
+					cells = [str(c) for c in counts[i].tolist()]
+				else:
+					cells = ["{0:.4f}".format(f) if c else str(0.0000) for c, f in zip(counts[i].tolist(), freqs[i].tolist())]
+				fh.write(label + "\t" + "\t".join(cells) + "\n")
+		except IOError:
+			print("Could not read file ",fh)
+			sys.exit(1)
+
+#Function to store a haplotype as 4-bit packed bytes (see alignment_tools)
+#Falls back to the plain string if it contains non-IUPAC characters
+def packHap(seq):
+	try:
+		return(aln.pack_sequence(seq))
+	except ValueError:
+		return(seq)
+
+#Function to return haplotype string from packHap output
+def unpackHap(hap):
+	if isinstance(hap, bytes):
+		return(aln.unpack_sequence(hap))
+	return(hap)
 
 #Function to check that list of sample names and popmap entries match
 def validatePopmap(samples, popmap):
@@ -252,7 +239,7 @@ class parseArgs():
 	def __init__(self):
 		#Define options
 		try:
-			options, remainder = getopt.getopt(sys.argv[1:], 'p:o:hf:dc:', \
+			options, remainder = getopt.getopt(sys.argv[1:], 'p:o:hf:dc:rb:sm:', \
 			["help"])
 		except getopt.GetoptError as err:
 			print(err)
@@ -265,6 +252,11 @@ class parseArgs():
 		self.dip=False
 		self.out2=None
 		self.code_table=None
+		self.reps=False
+		self.pending=hapt.MAX_PENDING
+		self.unpaired=None
+		self.partial=False
+		self.merge=None
 
 		#First pass to see if help menu was called
 		for o, a in options:
@@ -289,18 +281,36 @@ class parseArgs():
 				self.dip=True
 			elif opt == "c":
 				self.code_table = arg
+			elif opt == "r":
+				self.reps = True
+			elif opt == "b":
+				self.pending = int(arg)
+			elif opt == "s":
+				self.partial = True
+			elif opt == "m":
+				self.merge = arg
 			else:
 				assert False, "Unhandled option %r"%opt
 
 		#Check manditory options are set
-		if not self.fasta:
-			self.display_help("Error: Missing required input file (-f,--fasta).")
+		if not self.fasta and not self.merge:
+			self.display_help("Error: Missing required input file (-f,--fasta) or partial counts to merge (-m).")
+		if self.fasta and self.merge:
+			self.display_help("Error: Give either a FASTA file (-f) or partial counts to merge (-m), not both.")
+		if self.merge and (self.popmap or self.code_table or self.dip):
+			self.display_help("Error: Popmap (-p), coding table (-c) and diplotypes (-d) are set when partial counts are made, not with -m.")
 
 		if self.out:
 			self.out2 = self.out + "_counts.tsv"
+			self.unpaired = self.out + "_unpaired.tsv"
+			self.partial = self.out + "_partial.npz" if self.partial else None
+			self.reps = self.out + "_haps.fasta" if self.reps else None
 			self.out = self.out + "_freq.tsv"
 		else:
 			self.out2 = "out_counts.tsv"
+			self.unpaired = "out_unpaired.tsv"
+			self.partial = "out_partial.npz" if self.partial else None
+			self.reps = "out_haps.fasta" if self.reps else None
 			self.out = "out_freq.tsv"
 
 
@@ -323,7 +333,17 @@ class parseArgs():
 			          and a column "ALLPOPS" which will include only samples from the popmap.
 			          This is intended to make it easy to get frequencies/ counts for subsets.
 		-d	: Output frequencies/ counts of diplotypes
+			  --NOTE: Haplotypes are paired by names ending in _A and _B. Any that can't be
+			          paired are listed in <out_prefix>_unpaired.tsv
+		-b	: With -d, maximum number of haplotypes waiting for their pair before the
+			  oldest is given up on (0 for no limit) <default = 10000>
 		-c	: Path to a tab-delimited table for coding haplotypes
+		-s	: Also write raw counts (and representative sequences) to <out_prefix>_partial.npz,
+			  which can be merged with those of other runs using -m
+		-m	: Merge partial counts from -s instead of reading a FASTA file: comma-separated
+			  list of files and/or quoted glob (e.g. 'shards/*_partial.npz')
+		-r	: Also write one representative sequence per haplotype to <out_prefix>_haps.fasta,
+			  named by the digest of the haplotype (diplotypes as <digest>_A and <digest>_B)
 		-h	: Displays help menu
 		""")
 		print()
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+import hashlib
+from array import array
+from collections import OrderedDict
+import numpy as np
+
+#Bytes in a haplotype digest (see hap_digest)
+DIGEST_SIZE = 16
+
+#Default maximum number of haplotypes waiting for their pair (see hapPairs)
+MAX_PENDING = 10000
+
+############################# CLASSES ##################################
+
+class hapCounts():
+	'Counts of distinct haplotypes, overall and in each population'
+	#Default constructor
+	#Each distinct haplotype (any hashable key, e.g. a packed sequence) gets an
+	#integer ID the first time it is seen, as does each population. Samples are
+	#only counted, per haplotype and per (haplotype, population) cell, so memory
+	#grows with the number of distinct haplotypes rather than samples
+	def __init__(self):
+		self.haps = list() #haplotype keys, by ID
+		self.pops = list() #population names, by ID
+		self.samples = 0
+		self._hap_index = dict()
+		self._pop_index = dict()
+		self._totals = array("q") #samples, by haplotype ID
+		self._cells = dict() #(haplotype ID, population ID) -> samples
+
+	#Returns the number of samples added
+	def __len__(self):
+		return self.samples
+
+	#Returns the ID of a haplotype, giving it the next ID if it is new
+	def hap_id(self, hap):
+		i = self._hap_index.get(hap)
+		if i is None:
+			i = self._hap_index[hap] = len(self.haps)
+			self.haps.append(hap)
+			self._totals.append(0)
+		return(i)
+
+	#Returns the ID of a population, giving it the next ID if it is new
+	def pop_id(self, pop):
+		i = self._pop_index.get(pop)
+		if i is None:
+			i = self._pop_index[pop] = len(self.pops)
+			self.pops.append(pop)
+		return(i)
+
+	#Adds one sample with haplotype hap, in population pop (None for no population)
+	#Returns the haplotype's ID (equal to the number of haplotypes before, if new)
+	def add(self, hap, pop=None):
+		i = self.hap_id(hap)
+		self.samples += 1
+		self._totals[i] += 1
+		if pop is not None:
+			cell = (i, self.pop_id(pop))
+			self._cells[cell] = self._cells.get(cell, 0) + 1
+		return(i)
+
+	#Returns the number of samples with each haplotype, by haplotype ID
+	def totals(self):
+		return(np.array(self._totals, dtype=np.int64))
+
+	#Returns a (haplotypes x populations) matrix of counts, by ID
+	def counts(self):
+		counts = np.zeros((len(self.haps), len(self.pops)), dtype=np.int64)
+		if self._cells:
+			cells = np.array(list(self._cells.keys()), dtype=np.int64)
+			counts[cells[:, 0], cells[:, 1]] = np.fromiter(self._cells.values(), dtype=np.int64, count=len(self._cells))
+		return(counts)
+
+	#Returns a hapTable of the counts so far, keyed by haplotype (which must be
+	#a digest, see hap_digest). labels and reps are strings, by haplotype ID
+	def table(self, labels, reps, dip=False, grouped=False):
+		new = hapTable(dip, grouped)
+		new.digests = list(self.haps)
+		new.labels = list(labels)
+		new.reps = list(reps)
+		new.pops = list(self.pops)
+		new.counts = self.counts()
+		new.totals = self.totals()
+		new._index = dict(self._hap_index)
+		new._pop_index = dict(self._pop_index)
+		return(new)
+
+class hapTable():
+	'Haplotype counts by population, which can be saved and merged with others'
+	#Default constructor
+	#Each haplotype has a digest (its key), a label (its sequence or code) and
+	#a representative sequence. dip is True for diplotypes, grouped is True if
+	#samples were assigned to populations (so ALLPOPS is reported)
+	def __init__(self, dip=False, grouped=False):
+		self.dip = dip
+		self.grouped = grouped
+		self.digests = list()
+		self.labels = list()
+		self.reps = list()
+		self.pops = list()
+		self.counts = np.zeros((0, 0), dtype=np.int64) #haplotypes x populations
+		self.totals = np.zeros(0, dtype=np.int64) #all samples, inc. no population
+		self._index = dict()
+		self._pop_index = dict()
+
+	#Returns the number of haplotypes
+	def __len__(self):
+		return len(self.digests)
+
+	#Add counts from another hapTable (e.g. counted from another shard of samples)
+	#Haplotypes are matched by digest and populations by name; new ones are
+	#added after those already in the table
+	def merge(self, other):
+		if other.dip != self.dip:
+			raise ValueError("Can't merge haplotype counts with diplotype counts")
+		self.grouped = self.grouped or other.grouped
+		cols = np.zeros(len(other.pops), dtype=np.int64)
+		for j, pop in enumerate(other.pops):
+			cols[j] = self._pop_index.get(pop, -1)
+			if cols[j] < 0:
+				cols[j] = self._pop_index[pop] = len(self.pops)
+				self.pops.append(pop)
+		rows = np.zeros(len(other), dtype=np.int64)
+		for j, digest in enumerate(other.digests):
+			rows[j] = self._index.get(digest, -1)
+			if rows[j] < 0:
+				rows[j] = self._index[digest] = len(self.digests)
+				self.digests.append(digest)
+				self.labels.append(other.labels[j])
+				self.reps.append(other.reps[j])
+		counts = np.zeros((len(self.digests), len(self.pops)), dtype=np.int64)
+		counts[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+		counts[np.ix_(rows, cols)] += other.counts
+		self.counts = counts
+		self.totals = np.concatenate((self.totals, np.zeros(len(self.digests)-len(self.totals), dtype=np.int64)))
+		self.totals[rows] += other.totals
+
+	#Save counts to a .npz file, so a partial state can be merged later
+	#Labels and representatives are stored as UTF-8 text with end offsets; a
+	#representative the same as its label is stored as empty
+	def save(self, path):
+		labels, label_ends = _join_strings(self.labels)
+		reps, rep_ends = _join_strings("" if r == l else r for r, l in zip(self.reps, self.labels))
+		digests = np.frombuffer(b"".join(self.digests), dtype=np.uint8).reshape(-1, DIGEST_SIZE)
+		np.savez(path, dip=self.dip, grouped=self.grouped, digests=digests, pops=np.array(self.pops, dtype=str), \
+			counts=self.counts, totals=self.totals, labels=labels, label_ends=label_ends, reps=reps, rep_ends=rep_ends)
+
+	#Load counts saved with save()
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			new = cls(bool(data["dip"]), bool(data["grouped"]))
+			new.digests = [d.tobytes() for d in data["digests"]]
+			new.pops = [str(p) for p in data["pops"]]
+			new.counts = data["counts"].astype(np.int64).reshape(len(new.digests), len(new.pops))
+			new.totals = data["totals"].astype(np.int64)
+			new.labels = _split_strings(data["labels"], data["label_ends"])
+			reps = _split_strings(data["reps"], data["rep_ends"])
+			new.reps = [r if r else l for r, l in zip(reps, new.labels)]
+		new._index = {d: i for i, d in enumerate(new.digests)}
+		new._pop_index = {p: i for i, p in enumerate(new.pops)}
+		return new
+
+class hapPairs():
+	'Pairs the _A and _B haplotypes of each sample from a stream of records'
+	#Default constructor
+	#records yields (name, haplotype, sequence), where the haplotype is its
+	#sequence or code (as a string); a pair is two names that differ
+	#only in ending with _A or _B. Haplotypes wait in a buffer until their pair
+	#is read. If more than max_pending are waiting (0 for no limit), the oldest
+	#is given up on. Haplotypes that aren't paired are listed in unpaired
+	def __init__(self, records, max_pending=MAX_PENDING):
+		self.records = records
+		self.max_pending = max_pending
+		self.pairs = 0
+		self.unpaired = list() #(name, reason)
+
+	#Yields (sample name with _A, diplotype key, representative) for each pair,
+	#as it is completed (see diplotype_key)
+	def __iter__(self):
+		pending = OrderedDict() #sample -> (name, haplotype, sequence)
+		for name, hap, seq in self.records:
+			if not name.endswith(_SUFFIXES):
+				self.unpaired.append((name, "no _A/_B suffix"))
+				continue
+			sample = name[:-2]
+			other = pending.pop(sample, None)
+			if other is not None and other[0] != name:
+				self.pairs += 1
+				if name.endswith("_B"):
+					key, rep = diplotype_key(other[1], hap, other[2], seq)
+				else:
+					key, rep = diplotype_key(hap, other[1], seq, other[2])
+				yield((sample + "_A", key, rep))
+				continue
+			if other is not None:
+				self.unpaired.append((name, "duplicate name"))
+			pending[sample] = (name, hap, seq)
+			if self.max_pending and len(pending) > self.max_pending:
+				old = pending.popitem(last=False)[1]
+				self.unpaired.append((old[0], "gave up: more than %s haplotypes waiting for a pair"%self.max_pending))
+		for name, hap, seq in pending.values():
+			self.unpaired.append((name, "no pair"))
+
+######################## STATIC FUNCTIONS ##############################
+
+#Function to get a fixed-size key for a haplotype sequence (or code) string
+def hap_digest(seq):
+	return(hashlib.blake2b(seq.encode("utf-8"), digest_size=DIGEST_SIZE).digest())
+
+#Function to get the key of a diplotype: its two haplotypes in sorted order,
+#so the key doesn't depend on which is _A and which is _B
+#Returns (key, representative), where the representative joins the two
+#haplotypes' sequences in the same order as the key
+def diplotype_key(hapA, hapB, seqA, seqB):
+	if hapA < hapB:
+		return((hapA + "/" + hapB, seqA + "/" + seqB))
+	return((hapB + "/" + hapA, seqB + "/" + seqA))
+
+#Function to convert a (haplotypes x columns) matrix of counts to frequencies
+#within each column; columns with no samples are left as 0
+def count_frequencies(counts):
+	totals = counts.sum(axis=0)
+	freqs = np.zeros(counts.shape, dtype=np.float64)
+	np.divide(counts, totals, out=freqs, where=totals > 0)
+	return(freqs)
+
+#Function to join strings as one UTF-8 array, with the end offset of each
+def _join_strings(strings):
+	data = [x.encode("utf-8") for x in strings]
+	ends = np.cumsum([len(x) for x in data], dtype=np.int64)
+	return((np.frombuffer(b"".join(data), dtype=np.uint8), ends))
+
+#Function to split strings joined with _join_strings
+def _split_strings(data, ends):
+	data = data.tobytes()
+	starts = [0] + ends[:-1].tolist()
+	return([data[i:j].decode("utf-8") for i, j in zip(starts, ends.tolist())])
+
+######################## LOOKUP TABLES #################################
+
+#Name endings of the two haplotypes of a sample
+_SUFFIXES = ("_A", "_B")
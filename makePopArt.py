@@ -4,6 +4,7 @@ import re
 import sys
 import os
 import getopt
+from fasta_tools import read_fasta
 
 def main():
 	params = parseArgs()
@@ -79,43 +80,6 @@ def main():
 
 
 
-#Read genome as FASTA. FASTA header will be used
-#This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
-
-	if os.path.exists(fas):
-		with open(fas, 'r') as fh:
-			try:
-				contig = ""
-				seq = ""
-				for line in fh:
-					line = line.strip()
-					if not line:
-						continue
-					#print(line)
-					if line[0] == ">": #Found a header line
-						#If we already loaded a contig, yield that contig and
-						#start loading a new one
-						if contig:
-							yield([contig,seq]) #yield
-							contig = "" #reset contig and seq
-							seq = ""
-						split_line = line.split()
-						contig = (split_line[0].replace(">",""))
-					else:
-						seq += line
-				#Iyield last sequence, if it has both a header and sequence
-				if contig and seq:
-					yield([contig,seq])
-			except IOError:
-				print("Could not read file ",fas)
-				sys.exit(1)
-			finally:
-				fh.close()
-	else:
-		raise FileNotFoundError("File %s not found!"%fas)
-
 #Function to read NEXUS and get list of sample names
 def getSamplesNexus(nex):
 	if os.path.exists(nex):
@@ -4,199 +4,441 @@ import re
 import sys
 import os
 import getopt
-import Bio
-import alignment_tools as aln
-from Bio import AlignIO
+import glob
+import itertools
+import fasta_tools as fasta
+import misc_utils as utils
+from phase_tools import read_pairs, stitch_diplotypes
+
+#Number of individuals rebuilt as full sequences at once (with -f)
+BATCH_SIZE = 256
 
 def main():
 	params = parseArgs()
-	full_seq = False
-	cons_sequences = dict()
-	positions = []
-	
-	#If fasta provided, parse it for consensus sequences and variable positions 
-	if params.fasta:
-		print("Haplotypes will be exported as full sequences")
-		full_seq = True
-		#If fasta provided:
-		if params.fasta:
-			
-			print("Reading FASTA...")
-			#Initialize empty AlignIO object
-			locus = Bio.Align.MultipleSeqAlignment([])
-
-			#Add each sequence to the AlignIO
-			for seq in read_fasta(params.fasta):
-				#Add to AlignIO alignment
-				locus.add_sequence(seq[0], seq[1])
-				#also population our dictionary 
-				cons_sequences[seq[0]] = seq[1]
-
-			#Generate catalog of variable positions
-			alignment = aln.consensAlign(locus, threshold=1.0, mask=1.0)
-			
-			#Get variable positions from alignment
-			for var in alignment.alnVars:
-				positions.append(var.position) 
-		
-	else:
-		print("Haplotypes will be exported as variable columns only.")
-		
+
+	#If a batch of loci provided:
+	if params.batch:
+		runBatch(params)
+
+	#split pairs file for several loci
+	elif params.pairs and params.loci:
+		try:
+			rows = parseLociFile(params.pairs, params.prefix, params.minp, params.loci, known=params.known, \
+				sites=params.sites, blocks=params.blocks)
+		except (IOError, ValueError) as e:
+			print("Error:",e)
+			sys.exit(1)
+		writeSummary(params.prefix, [[row[0], params.pairs, row[1], row[2]] + list(row[3:]) + ["OK"] for row in rows])
+		print("Done! Wrote %s loci. Summary can be found in %s"%(len(rows), params.prefix + "_summary.tsv"))
+
 	#parse pairs file 
-	if params.pairs:
-		print("Reading pairs file...")
-		#Open pairs file for reading 
-		if os.path.exists(params.pairs):
-			with open(params.pairs, 'r') as f:
-				try:
-					ofh = open(params.out, "w")
-					this_ind = None
-					assigns = []
-					for line in f:
-						line = line.strip()
-						if not line:
-							continue 
-						#Check if this is an individual header, or hap data
-						if line[0] == "I":
-							if this_ind:
-								#If an ind already assigned, parse it's list
-								best = chooseDiplotype(assigns, params.minp)
-								if best:
-									if full_seq:
-										if this_ind in cons_sequences:
-											full_dip = getFullDiplotype(cons_sequences[this_ind], best, positions)
-											if full_dip:
-												out1 = ">" + this_ind + "_A" + "\n" + full_dip[0] + "\n"
-												out2 = ">" + this_ind + "_B" + "\n" + full_dip[1] + "\n"
-												ofh.write(out1)
-												ofh.write(out2)
-											else:
-												print("Oh no! Something went wrong with getFullDiplotype()! My creator was too lazy to implement better error check though, so I don't know what went wrong!")
-										else:
-											print("Warning: Individual %s doesn't seem to be in the FASTA file... Skipping it."%this_ind)
-									else:
-										#print("PRINTING IND",this_ind)
-										#print best to file 
-										out1 = ">" + this_ind + "_A" + "\n" + best[0] + "\n"
-										out2 = ">" + this_ind + "_B" + "\n" + best[1] + "\n"
-										ofh.write(out1)
-										ofh.write(out2)
-								else:
-									print("Warning: No diplotypes of probability >= %s for sample %s"%(params.minp, this_ind))
-								#Then, empty assigns and this_ind variables 
-								words = line.split()
-								this_ind = words[1] #Set new individual, reset assigned haps 
-								del assigns[:]
-							else:
-								words = line.split()
-								this_ind = words[1]
-								del assigns[:]
-								continue 
-						else:
-							#This line must contain data 
-							stuff = line.replace(" ","").split(",")
-							assigns.append(stuff)
-					if this_ind:
-						if len(assigns) > 0:
-							best = chooseDiplotype(assigns, params.minp)
-							if best:
-								if full_seq:
-									if this_ind in cons_sequences:
-										full_dip = getFullDiplotype(cons_sequences[this_ind], best, positions)
-										if full_dip:
-											out1 = ">" + this_ind + "_A" + "\n" + full_dip[0] + "\n"
-											out2 = ">" + this_ind + "_B" + "\n" + full_dip[1] + "\n"
-											ofh.write(out1)
-											ofh.write(out2)
-										else:
-											print("Oh no! Something went wrong with getFullDiplotype()! My creator was too lazy to implement better error check though, so I don't know what went wrong!")
-									else:
-										print("Warning: Individual %s doesn't seem to be in the FASTA file... Skipping it."%this_ind)
-								else:
-									#print("PRINTING IND",this_ind)
-									#print best to file 
-									out1 = ">" + this_ind + "_A" + "\n" + best[0] + "\n"
-									out2 = ">" + this_ind + "_B" + "\n" + best[1] + "\n"
-									ofh.write(out1)
-									ofh.write(out2)
-					ofh.close()
-				except IOError: 
-					print("Could not read file ",pairs)
-					sys.exit(1)
-				finally:
-					f.close()
+	elif params.pairs:
+		try:
+			parsePairsFile(params.pairs, params.out, params.minp, params.fasta, known=params.known, \
+				sites=params.sites, blocks=params.blocks)
+		except IOError as e:
+			print("Could not read file:",e)
+			sys.exit(1)
+		except ValueError as e:
+			print("Error:",e)
+			sys.exit(1)
 
 	else:
 		print("No input provided")
 		sys.exit(1)
 
-#Returns full diplotype sequence from consensus sequence, and variable-only diplotye 
-def getFullDiplotype(seq, v, pos):
-	hap1 = seq
-	hap2 = seq
-	
-	index = 0
-	for i, p in enumerate(pos):
-		p = int(p)
-		#hap1 = hap1[:p] + "[" + v[0][i] + "]" + hap1[p+1:]
-		#hap2 = hap2[:p] + "[" + v[1][i] + "]" + hap2[p+1:]
-		hap1 = hap1[:p] + v[0][i] + hap1[p+1:]
-		hap2 = hap2[:p] + v[1][i] + hap2[p+1:]
-	return([hap1, hap2])
-
-
-#Read genome as FASTA. FASTA header will be used
-#This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
-	if not fileCheck(fas):
-		raise FileNotFoundError("Fatal exception, file %s not found."%fas)
-
-	fh = open(fas)
+#Function to extract best diplotypes from one .pairs file to a FASTA file
+#If fasta is given, haplotypes are written as full sequences
+#If known is given, individuals held out of PHASE by fasta2phase.py -k hold
+#(its _known_pairs file) are added after those in the .pairs file
+#If sites is given (the _sites.tsv site map from fasta2phase.py), haplotypes
+#are placed at its alignment columns; otherwise at every variable column of fasta
+#If blocks is given (the _blocks.tsv block map from fasta2phase.py -n), pairs
+#is a comma-separated list or quoted glob of .pairs files, one per block in
+#order, and each individual's block diplotypes are stitched together (see
+#phase_tools.stitch_diplotypes)
+#Returns (number of individuals, number written, list of dropped [individual, reason])
+#where reason is "minp" (no diplotype passing minp), "missing" (not in the
+#FASTA), or "failed" (haplotypes don't fit the FASTA)
+def parsePairsFile(pairs, out, minp, fas=None, verbose=True, known=None, sites=None, blocks=None):
+	records = getDiplotypes(pairs, minp, known, sites, blocks)
+	positions = getPositions(fas, sites, verbose)
+	if verbose:
+		print("Reading pairs file...")
+	#Stream individuals from the pairs file, writing each as it is read
+	nind = 0
+	unlinked = 0
+	writer = diplotypeWriter(out, fas, positions, verbose)
+	try:
+		for name, best, joins in records:
+			nind += 1
+			unlinked += int(joins > 0)
+			if not best and verbose:
+				print("Warning: No diplotypes of probability >= %s for sample %s"%(minp, name))
+			writer.add(name, best)
+	finally:
+		writer.close()
+	if unlinked and verbose:
+		print("Warning: For %s individuals, at least one block overlap had no heterozygous sites telling the phase of neighbouring blocks apart."%unlinked)
+	return((nind, writer.written, writer.dropped))
+
+#Function to split the .pairs output for a .inp of several loci (fasta2phase.py -c)
+#back into one FASTA per locus, <prefix>_<locus>_pairs.fasta, using its locus
+#map (<out>_loci.tsv). Haplotypes are written as full sequences if the FASTA
+#files in the locus map exist. Other arguments are as for parsePairsFile
+#Returns a list of (locus, FASTA, output, individuals, written, dropped) per locus
+def parseLociFile(pairs, prefix, minp, loci, verbose=True, known=None, sites=None, blocks=None):
+	records = getDiplotypes(pairs, minp, known, sites, blocks)
+	rows = readLocusMap(loci)
+	combined = readSiteMap(sites) if sites else None
+	writers = list()
 	try:
-		with fh as file_object:
-			contig = ""
-			seq = ""
-			for line in file_object:
-				line = line.strip()
-				if not line:
-					continue
-				#print(line)
-				if line[0] == ">": #Found a header line
-					#If we already loaded a contig, yield that contig and
-					#start loading a new one
-					if contig:
-						yield([contig,seq]) #yield
-						contig = "" #reset contig and seq
-						seq = ""
-					split_line = line.split()
-					contig = (split_line[0].replace(">",""))
+		for row in rows:
+			fas = row["FASTA"] if os.path.isfile(row["FASTA"]) else None
+			out = prefix + "_" + row["Locus"] + "_pairs.fasta"
+			positions = None
+			if fas and combined is not None:
+				#Site map positions are offset for each locus, as in the .inp
+				positions = [p - row["Offset"] for p in combined[row["FirstSite"]-1:row["LastSite"]]]
+			elif fas:
+				positions = getPositions(fas, None, False)
+			writers.append(diplotypeWriter(out, fas, positions, verbose))
+		if verbose:
+			print("Splitting %s loci from pairs file..."%len(rows))
+		nind = 0
+		for name, best, joins in records:
+			nind += 1
+			if not best and verbose:
+				print("Warning: No diplotypes of probability >= %s for sample %s"%(minp, name))
+			for row, writer in zip(rows, writers):
+				if best:
+					lo, hi = row["FirstSite"]-1, row["LastSite"]
+					writer.add(name, [best[0][lo:hi], best[1][lo:hi], best[2]])
 				else:
-					seq += line
-		#Iyield last sequence, if it has both a header and sequence
-		if contig and seq:
-			yield([contig,seq])
+					writer.add(name, None)
 	finally:
-		fh.close()
+		for writer in writers:
+			writer.close()
+	return([(row["Locus"], writer.fas, writer.out, nind, writer.written, writer.dropped) for row, writer in zip(rows, writers)])
+
+#Function to check inputs and get a stream of (name, best diplotype or None,
+#unphased block joins) for each individual (see parsePairsFile)
+def getDiplotypes(pairs, minp, known=None, sites=None, blocks=None):
+	pairs_files = getPairsFiles(pairs) if blocks else [pairs]
+	for f in pairs_files + [known, sites, blocks]:
+		if f and not os.path.exists(f):
+			raise FileNotFoundError("File %s not found!"%f)
+	if blocks:
+		block_sites = readBlockMap(blocks)
+		if len(block_sites) != len(pairs_files):
+			raise ValueError("Got %s .pairs files for %s blocks in %s"%(len(pairs_files), len(block_sites), blocks))
+		records = stitchDiplotypes(pairs_files, block_sites, minp)
+	else:
+		records = bestDiplotypes(pairs, minp)
+	if known:
+		records = itertools.chain(records, bestDiplotypes(known, minp))
+	return(records)
+
+#Function to get the 0-based alignment columns of the sites in PHASE output:
+#from the site map if given, otherwise every variable column of fasta
+#Returns an empty list if there is no fasta (variable columns only)
+def getPositions(fas, sites=None, verbose=True):
+	if not fas:
+		if verbose:
+			print("Haplotypes will be exported as variable columns only.")
+		return(list())
+	if verbose:
+		print("Haplotypes will be exported as full sequences")
+		print("Reading FASTA...")
+	if sites:
+		#Sites retained by fasta2phase.py filters
+		return(readSiteMap(sites))
+	import alignment_tools as aln #numpy is only needed for full sequences
+	#Generate catalog of variable positions in one streaming pass,
+	#or load it from the <fasta>.cat sidecar written by fasta2phase.py
+	alignment = aln.consensAlign.from_fasta(fas, threshold=1.0, mask=1.0)
+	return(alignment.alnVars.positions.tolist())
+
+#Function to get the best diplotype of each individual in a .pairs file
+#This is a generator function, yielding (name, best diplotype or None, 0)
+def bestDiplotypes(pairs, minp):
+	for rec in read_pairs(pairs):
+		yield((rec.name, chooseDiplotype(rec, minp), 0))
+
+#Function to stitch the best diplotypes of each individual across the .pairs
+#files of consecutive blocks (read in step, so individuals must be in the same order)
+#This is a generator function, yielding (name, stitched diplotype or None if any
+#block has none passing minp, number of joins that couldn't be phased)
+def stitchDiplotypes(pairs_files, blocks, minp):
+	for recs in itertools.zip_longest(*[read_pairs(p) for p in pairs_files]):
+		if any(rec is None for rec in recs):
+			raise ValueError("Block .pairs files don't have the same number of individuals")
+		name = recs[0].name
+		if any(rec.name != name for rec in recs):
+			raise ValueError("Individuals in block .pairs files are not in the same order (%s vs %s)"%(name, \
+				[rec.name for rec in recs if rec.name != name][0]))
+		bests = [chooseDiplotype(rec, minp) for rec in recs]
+		if any(best is None for best in bests):
+			yield((name, None, 0))
+		else:
+			best, joins = stitch_diplotypes(bests, blocks)
+			yield((name, best, joins))
+
+#Function to get the list of .pairs files for blocks, from a comma-separated
+#list of files and/or quoted globs (glob matches are sorted by name)
+def getPairsFiles(pairs):
+	files = list()
+	for p in pairs.split(","):
+		matches = sorted(glob.glob(p))
+		files.extend(matches if matches else [p])
+	return(files)
+
+#Function to read (first, last+1) 0-based site indices of each block from a
+#fasta2phase.py block map (<out>_blocks.tsv). Neighbouring blocks must overlap
+def readBlockMap(blocks):
+	sites = list()
+	with open(blocks, "r") as fh:
+		header = fh.readline().rstrip("\n").split("\t")
+		if "FirstSite" not in header or "LastSite" not in header:
+			raise ValueError("No FirstSite/LastSite columns in block map %s"%blocks)
+		first = header.index("FirstSite")
+		last = header.index("LastSite")
+		for line in fh:
+			stuff = line.rstrip("\n").split("\t")
+			if len(stuff) > max(first, last):
+				sites.append((int(stuff[first]) - 1, int(stuff[last])))
+	for prev, block in zip(sites, sites[1:]):
+		#Touching blocks (dist=0) don't count as overlapping here
+		if not utils.checkOverlap({"start":prev[0], "stop":prev[1]-1}, {"start":block[0], "stop":block[1]-1}, 0):
+			raise ValueError("Blocks %s-%s and %s-%s in %s don't overlap"%(prev[0]+1, prev[1], block[0]+1, block[1], blocks))
+	return(sites)
+
+#Function to process a manifest of loci, spread over a pool of worker processes
+#Writes <out>_<locus>_pairs.fasta per locus, a <out>_summary.tsv table of counts
+#per locus, and <out>_dropped.tsv listing each individual not written
+def runBatch(params):
+	loci = getBatchLoci(params.batch)
+	if len(loci) == 0:
+		sys.exit("No loci found in manifest %s"%params.batch)
+	print("Found %s loci. Parsing using %s worker(s)..."%(len(loci), params.threads))
+
+	jobs = [(locus, pairs, fas, params.prefix + "_" + locus + "_pairs.fasta", params.minp, known, sites, blocks) \
+		for locus, pairs, fas, known, sites, blocks in loci]
+	if params.threads > 1:
+		import multiprocessing #only needed in batch mode
+		with multiprocessing.Pool(params.threads) as pool:
+			results = list(pool.imap(batchWorker, jobs))
+	else:
+		results = [batchWorker(job) for job in jobs]
+
+	rows = [[job[0], job[1], job[2], job[3]] + list(res) for job, res in zip(jobs, results)]
+	failed = writeSummary(params.prefix, rows)
+	print("Done! Parsed %s of %s loci. Summary can be found in %s, and dropped individuals in %s"%(len(loci)-failed, \
+		len(loci), params.prefix + "_summary.tsv", params.prefix + "_dropped.tsv"))
 
+#Function to write <prefix>_summary.tsv, with counts per locus, and
+#<prefix>_dropped.tsv, listing each individual not written. rows are
+#(locus, pairs, fasta, output, individuals, written, dropped, status)
+#Returns number of loci that failed
+def writeSummary(prefix, rows):
+	failed = 0
+	with open(prefix + "_summary.tsv", "w") as sfh, open(prefix + "_dropped.tsv", "w") as dfh:
+		sfh.write("Locus\tPairs\tFASTA\tOutput\tIndividuals\tWritten\tBelowMinP\tMissing\tFailed\tStatus\n")
+		dfh.write("Locus\tIndividual\tReason\n")
+		for locus, pairs, fas, out, nind, written, drops, status in rows:
+			if status != "OK":
+				failed += 1
+				print("Warning: Locus %s failed: %s"%(locus, status))
+			reasons = [d[1] for d in drops]
+			counts = [reasons.count(r) for r in ("minp", "missing", "failed")]
+			sfh.write("\t".join(str(x) for x in (locus, pairs, fas if fas else "-", out)) + "\t")
+			sfh.write("\t".join(str(x) for x in [nind, written] + counts + [status]) + "\n")
+			for d in drops:
+				dfh.write(locus + "\t" + d[0] + "\t" + d[1] + "\n")
+	return(failed)
 
-#Parses a list of diplotype assignments, and returns the best one 
-#Only returns if diplotype has probabiltiy greater than thresh 
+#Worker for runBatch; job is (locus, pairs, fasta, out, minp, known, sites, blocks)
+#Returns (individuals, written, dropped, status) so one bad locus doesn't stop the batch
+def batchWorker(job):
+	locus, pairs, fas, out, minp, known, sites, blocks = job
+	try:
+		nind, written, dropped = parsePairsFile(pairs, out, minp, fas, verbose=False, known=known, sites=sites, blocks=blocks)
+		return((nind, written, dropped, "OK"))
+	except Exception as e:
+		return((0, 0, list(), "%s: %s"%(type(e).__name__, e)))
+
+#Function to read a manifest of loci as a list of (locus, pairs, fasta, known, sites, blocks)
+#Each line gives a .pairs file, optionally followed by the FASTA used with
+#fasta2phase.py ("-" for none), a locus name (default: .pairs file name),
+#the _known_pairs file from fasta2phase.py -k hold, its _sites.tsv site map,
+#and its _blocks.tsv block map (the .pairs are then a list or glob, one per block)
+def getBatchLoci(manifest):
+	loci = list()
+	with open(manifest, "r") as fh:
+		for line in fh:
+			line = line.strip()
+			if not line or line[0] == "#":
+				continue
+			stuff = line.split()
+			fas = stuff[1] if len(stuff) > 1 and stuff[1] != "-" else None
+			locus = stuff[2] if len(stuff) > 2 else locusName(stuff[0])
+			known = stuff[3] if len(stuff) > 3 and stuff[3] != "-" else None
+			sites = stuff[4] if len(stuff) > 4 and stuff[4] != "-" else None
+			blocks = stuff[5] if len(stuff) > 5 and stuff[5] != "-" else None
+			loci.append((locus, stuff[0], fas, known, sites, blocks))
+	return(loci)
+
+#Function to get a locus name from a .pairs path (file name without extension or "_pairs")
+def locusName(pairs):
+	name = os.path.splitext(os.path.basename(pairs))[0]
+	if name.endswith("_pairs") and len(name) > 6:
+		name = name[:-6]
+	return(name)
+
+#Function to read 0-based alignment columns from a fasta2phase.py site map
+#(the 1-based Position column of <out>_sites.tsv), in .inp order
+def readSiteMap(sites):
+	positions = list()
+	with open(sites, "r") as fh:
+		header = fh.readline().rstrip("\n").split("\t")
+		if "Position" not in header:
+			raise ValueError("No Position column in site map %s"%sites)
+		col = header.index("Position")
+		for line in fh:
+			stuff = line.rstrip("\n").split("\t")
+			if len(stuff) > col:
+				positions.append(int(stuff[col]) - 1)
+	return(positions)
+
+#Function to read a fasta2phase.py -c locus map (<out>_loci.tsv) as a list of
+#dicts with Locus, FASTA, FirstSite and LastSite (1-based, in the combined
+#.inp), Offset and Length
+def readLocusMap(loci):
+	rows = list()
+	with open(loci, "r") as fh:
+		header = fh.readline().rstrip("\n").split("\t")
+		for col in ("Locus", "FASTA", "FirstSite", "LastSite", "Offset"):
+			if col not in header:
+				raise ValueError("No %s column in locus map %s"%(col, loci))
+		for line in fh:
+			stuff = line.rstrip("\n").split("\t")
+			if len(stuff) < len(header):
+				continue
+			row = dict(zip(header, stuff))
+			for col in ("FirstSite", "LastSite", "Offset", "Length"):
+				if col in row:
+					row[col] = int(row[col])
+			rows.append(row)
+	return(rows)
+
+#Function to write a diplotype to the output file, as _A and _B haplotypes
+def writeDiplotype(ofh, name, dip):
+	out1 = ">" + name + "_A" + "\n" + dip[0] + "\n"
+	out2 = ">" + name + "_B" + "\n" + dip[1] + "\n"
+	ofh.write(out1)
+	ofh.write(out2)
+
+#Function to write full diplotype sequences for a batch of [name, consensus, best diplotype]
+#If the batch can't be filled at once, individuals are retried one at a time
+#Returns names of individuals that couldn't be written
+def writeFullDiplotypes(ofh, batch, pos, verbose=True):
+	if not batch:
+		return(list())
+	full_dips = getFullDiplotypes([b[1] for b in batch], [b[2] for b in batch], pos)
+	if full_dips is None and len(batch) > 1:
+		failed = list()
+		for b in batch:
+			failed.extend(writeFullDiplotypes(ofh, [b], pos, verbose))
+		return(failed)
+	elif full_dips is None:
+		if verbose:
+			print("Oh no! Something went wrong with getFullDiplotype() for %s! Consensus sequence or haplotypes don't match the FASTA used for the variable positions."%batch[0][0])
+		return([batch[0][0]])
+	for b, full_dip in zip(batch, full_dips):
+		writeDiplotype(ofh, b[0], full_dip)
+	return(list())
+
+#Returns full diplotype sequence from consensus sequence, and variable-only diplotye 
+def getFullDiplotype(seq, v, pos):
+	full_dips = getFullDiplotypes([seq], [v], pos)
+	if full_dips:
+		return(full_dips[0])
+	return(None)
+
+#Returns full diplotype sequences for lists of consensus sequences and variable-only diplotypes
+#Variable columns are written into a 2-D byte array in one step (see
+#alignment_tools.fill_haplotypes), or None if the inputs don't match
+def getFullDiplotypes(seqs, dips, pos):
+	import alignment_tools as aln #already loaded when -f is used
+	try:
+		haps = aln.fill_haplotypes([s for s in seqs for _ in (0, 1)], [h for d in dips for h in d[:2]], pos)
+	except ValueError:
+		return(None)
+	return([haps[i:i+2] for i in range(0, len(haps), 2)])
+
+
+#Parses the diplotype assignments for an individual (a diplotypeSet), and returns the
+#most probable one (the first, if tied). Only returns if its probability is >= thresh
 def chooseDiplotype(dips, thresh):
-	best = None 
-	current = 0.0
-	if len(dips) == 1:
-		return(dips[0])
-	for dip in dips:
-		if float(dip[2]) >= 0.0:
-			current = float(dip[2])
-			best = dip 
-			
-	if current < thresh:
+	if len(dips) == 0:
 		return(None)
-	else:
-		#print("chosen:",best)
-		return(best)
+	best = max(range(len(dips)), key=dips.prob.__getitem__)
+	if dips.prob[best] < thresh:
+		return(None)
+	return(dips.diplotype(best))
+
+
+#Object to write best diplotypes to a FASTA file
+class diplotypeWriter():
+	'Writes diplotypes as _A and _B haplotypes, of variable columns or full sequences'
+	#Default constructor
+	#If fas is given, haplotypes are written into each individual's consensus
+	#sequence at positions (0-based columns), BATCH_SIZE individuals at a time
+	#Consensus sequences are read through the FASTA's index
+	def __init__(self, out, fas=None, positions=None, verbose=True):
+		self.out = out
+		self.fas = fas
+		self.positions = positions if positions is not None else list()
+		self.verbose = verbose
+		self.written = 0
+		self.dropped = list() #[individual, reason]
+		self.batch = list()
+		self.cons_sequences = fasta.fastaIndex(fas) if fas else None
+		self.ofh = open(out, "w")
+
+	#Add an individual's best diplotype, or None if none passed minp
+	def add(self, name, best):
+		if not best:
+			self.dropped.append([name, "minp"])
+		elif self.cons_sequences is None:
+			#print best to file 
+			writeDiplotype(self.ofh, name, best)
+			self.written += 1
+		elif name not in self.cons_sequences:
+			self.dropped.append([name, "missing"])
+			if self.verbose:
+				print("Warning: Individual %s doesn't seem to be in the FASTA file %s... Skipping it."%(name, self.fas))
+		else:
+			self.batch.append([name, self.cons_sequences.fetch(name), best])
+			if len(self.batch) >= BATCH_SIZE:
+				self.flush()
+
+	#Write full sequences for the current batch
+	def flush(self):
+		failed = writeFullDiplotypes(self.ofh, self.batch, self.positions, self.verbose)
+		self.written += len(self.batch) - len(failed)
+		self.dropped.extend([name, "failed"] for name in failed)
+		self.batch = list()
+
+	def close(self):
+		if self.ofh.closed:
+			return
+		try:
+			self.flush()
+		finally:
+			self.ofh.close()
+			if self.cons_sequences is not None:
+				self.cons_sequences.close()
 
 
 #Object to parse command-line arguments
@@ -204,8 +446,8 @@ class parseArgs():
 	def __init__(self):
 		#Define options
 		try:
-			options, remainder = getopt.getopt(sys.argv[1:], 'p:o:m:hf:', \
-			["pairs=","out=","minp=","help","fasta="])
+			options, remainder = getopt.getopt(sys.argv[1:], 'p:o:m:hf:b:t:k:s:l:L:', \
+			["pairs=","out=","minp=","help","fasta=","batch=","threads=","known=","sites=","blocks=","loci="])
 		except getopt.GetoptError as err:
 			print(err)
 			self.display_help("\nExiting because getopt returned non-zero exit status.")
@@ -216,6 +458,15 @@ class parseArgs():
 		self.minp=0.5
 		
 		self.fasta=None
+		self.sites=None
+		self.blocks=None
+		self.loci=None
+		self.known=None
+		self.prefix=None
+
+		#Batch params
+		self.batch=None
+		self.threads=1
 
 		#First pass to see if help menu was called
 		for o, a in options:
@@ -238,16 +489,32 @@ class parseArgs():
 				self.minp = float(arg)
 			elif opt in ("f","fasta"):
 				self.fasta = arg
+			elif opt in ("s","sites"):
+				self.sites = arg
+			elif opt in ("l","blocks"):
+				self.blocks = arg
+			elif opt in ("L","loci"):
+				self.loci = arg
+			elif opt in ("k","known"):
+				self.known = arg
+			elif opt in ('b','batch'):
+				self.batch = arg
+			elif opt in ('t','threads'):
+				self.threads = int(arg)
 			else:
 				assert False, "Unhandled option %r"%opt
 
 		#Check manditory options are set
-		if not self.pairs:
-			self.display_help("Error: Missing required input file (-p,--pairs).")
+		if not self.pairs and not self.batch:
+			self.display_help("Error: Missing required input file (-p,--pairs or -b,--batch).")
+		if self.threads < 1:
+			self.display_help("Error: Number of threads (-t,--threads) must be at least 1.")
 
 		if self.out:
+			self.prefix = self.out
 			self.out = self.out + "_pairs.fasta"
 		else:
+			self.prefix = "out"
 			self.out = "out_pairs.fasta"
 
 
@@ -257,7 +524,8 @@ class parseArgs():
 			print (message)
 		print ("\nparsePairs.py\n")
 		print ("Contact:Tyler K. Chafin, University of Arkansas,tkchafin@uark.edu")
-		print ("\nUsage: ", sys.argv[0], "-p </path/to/.pairs  <-o out_prefix> <-m min_probability\n")
+		print ("\nUsage: ", sys.argv[0], "-p </path/to/.pairs  <-o out_prefix> <-m min_probability")
+		print ("       ", sys.argv[0], "-b <manifest>  <-t threads> <-o out_prefix> <-m min_probability\n")
 		print ("Description: Extracts phased haplotypes from PHASE output, using the '.pairs' file")
 
 		print("""
@@ -270,7 +538,32 @@ class parseArgs():
 	Haplotype expansion:
 	--Provide if you want haplotypes exported with full sequences.
 	--Otherwise, they'll be output as ONLY the variable columns.
-		-f,--fasta	: FASTA input file used with fasta2phase.py""")
+		-f,--fasta	: FASTA input file used with fasta2phase.py
+		-s,--sites	: <out_prefix>_sites.tsv site map from fasta2phase.py. Required
+			  if sites were filtered (-m, -x, -B), to place them at the right columns
+
+	Blocks:
+		-l,--blocks	: <out_prefix>_blocks.tsv block map from fasta2phase.py -n. -p is then
+			  a comma-separated list or quoted glob of .pairs files, one per block in
+			  order, and haplotypes are stitched across blocks where they overlap
+
+	Multi-locus input:
+		-L,--loci	: <out_prefix>_loci.tsv locus map from fasta2phase.py -c. The .pairs
+			  file is split back into <out_prefix>_<locus>_pairs.fasta for each locus
+			  (full sequences, if the locus FASTAs in the map exist), with
+			  <out_prefix>_summary.tsv and <out_prefix>_dropped.tsv
+
+	Known phase:
+		-k,--known	: _known_pairs file from fasta2phase.py -k hold. These individuals
+			  were left out of PHASE, and are added back with probability 1.0
+
+	Batch options:
+		-b,--batch	: Manifest file with one locus per line: path to .pairs file, then
+			  optionally the FASTA used with fasta2phase.py ("-" for none), a locus name,
+			  a _known_pairs file, a _sites.tsv site map, and a _blocks.tsv block map
+			--Writes <out_prefix>_<locus>_pairs.fasta per locus, <out_prefix>_summary.tsv,
+			  and <out_prefix>_dropped.tsv listing individuals below -m or missing from the FASTA
+		-t,--threads	: Number of worker processes for batch mode <default = 1>""")
 		print()
 		sys.exit()
 
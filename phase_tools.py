@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import sys
+import os
+from array import array
+import misc_utils as utils
+
+#Bytes read at a time by read_pairs
+CHUNK_SIZE = 1 << 20
+
+############################# CLASSES ##################################
+
+class diplotypeSet():
+	'Diplotype assignments for one individual from a PHASE .pairs file'
+	#Default constructor
+	#Haplotypes are kept as parallel lists, posterior probabilities as an array of doubles
+	def __init__(self, name, hap1=None, hap2=None, prob=None):
+		self.name = name
+		self.hap1 = hap1 if hap1 is not None else list()
+		self.hap2 = hap2 if hap2 is not None else list()
+		self.prob = array("d", prob if prob is not None else [])
+
+	def add(self, hap1, hap2, prob):
+		self.hap1.append(hap1)
+		self.hap2.append(hap2)
+		self.prob.append(prob)
+
+	def __len__(self):
+		return len(self.prob)
+
+	#Returns diplotype i as [hap1, hap2, probability]
+	def diplotype(self, i):
+		return([self.hap1[i], self.hap2[i], self.prob[i]])
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield(self.diplotype(i))
+
+######################## STATIC FUNCTIONS ##############################
+
+#Read a PHASE .pairs file, yielding one diplotypeSet per individual
+#This is a generator function
+#Each "IND: <name>" line starts an individual, followed by lines of
+#"hap1 , hap2 , probability". The file is read in large binary chunks
+def read_pairs(pairs, chunk_size=CHUNK_SIZE):
+	if not os.path.exists(pairs):
+		raise FileNotFoundError("File %s not found!"%pairs)
+
+	with open(pairs, "rb") as fh:
+		try:
+			name = None
+			hap1, hap2, prob = list(), list(), list()
+			tail = b""
+			while True:
+				data = fh.read(chunk_size)
+				lines = (tail + data).split(b"\n")
+				tail = lines.pop() if data else b"" #may be an incomplete line
+				for line in lines:
+					words = line.split()
+					if not words:
+						continue
+					#Check if this is an individual header, or hap data
+					if words[0][0] == 73: #"I"
+						if name is not None:
+							yield(diplotypeSet(name, hap1, hap2, prob))
+						name = words[1].decode("utf-8")
+						hap1, hap2, prob = list(), list(), list()
+					elif name is None:
+						continue
+					#Usual "hap1 , hap2 , prob" layout, otherwise split on commas
+					elif len(words) == 5 and words[1] == b"," and words[3] == b",":
+						hap1.append(words[0].decode("utf-8"))
+						hap2.append(words[2].decode("utf-8"))
+						prob.append(float(words[4]))
+					else:
+						stuff = line.replace(b" ", b"").split(b",")
+						if len(stuff) < 3:
+							raise ValueError("Malformed line in %s for individual %s: %s"%(pairs, name, line.strip().decode("utf-8")))
+						hap1.append(stuff[0].decode("utf-8"))
+						hap2.append(stuff[1].decode("utf-8"))
+						prob.append(float(stuff[2]))
+				if not data:
+					break
+			if name is not None:
+				yield(diplotypeSet(name, hap1, hap2, prob))
+		except IOError:
+			print("Could not read file ",pairs)
+			sys.exit(1)
+
+#Join diplotypes for consecutive, overlapping blocks of sites into one diplotype
+#dips is a [hap1, hap2, probability] for each block, and blocks the (first,
+#last+1) site indices of each. Each block's haplotypes are swapped if that
+#agrees better with the haplotypes so far at heterozygous sites in the overlap,
+#and the overlap is split at its middle. Returns ([hap1, hap2, probability],
+#number of joins where the overlap couldn't tell the phase apart)
+def stitch_diplotypes(dips, blocks):
+	if len(dips) != len(blocks):
+		raise ValueError("Got %s diplotypes for %s blocks"%(len(dips), len(blocks)))
+	hap1, hap2, prob = dips[0]
+	end = blocks[0][1]
+	unlinked = 0
+	for (new1, new2, p), (lo, hi) in zip(dips[1:], blocks[1:]):
+		if len(new1) != hi-lo or len(new2) != hi-lo:
+			raise ValueError("Haplotype has %s sites, expected %s for block %s-%s"%(len(new1), hi-lo, lo+1, hi))
+		overlap = utils.calcOverlap(0, end, lo, hi)
+		if overlap == 0 or hi <= end:
+			raise ValueError("Block %s-%s doesn't extend the previous block (sites 1-%s)"%(lo+1, hi, end))
+		keep = 0
+		swap = 0
+		for a1, a2, b1, b2 in zip(hap1[lo:end], hap2[lo:end], new1, new2):
+			if a1 == a2 or b1 == b2:
+				continue
+			keep += (a1 == b1 and a2 == b2)
+			swap += (a1 == b2 and a2 == b1)
+		if swap > keep:
+			new1, new2 = new2, new1
+		elif swap == keep:
+			unlinked += 1
+		cut = lo + overlap//2
+		hap1 = hap1[:cut] + new1[cut-lo:]
+		hap2 = hap2[:cut] + new2[cut-lo:]
+		prob *= p
+		end = hi
+	return(([hap1, hap2, prob], unlinked))
@@ -3,7 +3,8 @@
 import sys
 import os
 import getopt
-import pandas as pd
+import csv
+from fasta_tools import read_fasta
 
 def main():
 	params = parseArgs()
@@ -13,19 +14,24 @@ def main():
 	for f in read_fasta(params.infile):
 		seqs[f[0]] = f[1]
 	
-	#read hap table
-	freq = pd.read_csv(params.freq, sep="\t", header=0)
+	#read hap table (header row of population names, then one row per haplotype)
+	with open(params.freq, "r") as fh:
+		freq = list(csv.reader(fh, delimiter="\t"))
+	columns = freq[0]
 	
 	#make new dict of sequences
 	expanded=dict()
-	for index, row in freq.iterrows():
+	for row in freq[1:]:
+		if not row:
+			continue
 		hap=row[0]
 		idx=1
 		for pop in row[1:]:
-			if int(pop) > 0:
+			pop = int(float(pop))
+			if pop > 0:
 				for c in range(0,pop):
 					#print(c+1, " of ", pop)
-					key=str(freq.columns[idx]) + "_" + hap + "_" + str(c+1)
+					key=str(columns[idx]) + "_" + hap + "_" + str(c+1)
 					expanded[key] = seqs[hap]
 			idx+=1
 
@@ -54,43 +60,6 @@ def write_fasta(f, aln, width=None):
 		finally:
 			fh.close()
 	
-#Read genome as FASTA. FASTA header will be used
-#This is a generator function
-#Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
-
-	if os.path.exists(fas):
-		with open(fas, 'r') as fh:
-			try:
-				contig = ""
-				seq = ""
-				for line in fh:
-					line = line.strip()
-					if not line:
-						continue
-					#print(line)
-					if line[0] == ">": #Found a header line
-						#If we already loaded a contig, yield that contig and
-						#start loading a new one
-						if contig:
-							yield([contig,seq]) #yield
-							contig = "" #reset contig and seq
-							seq = ""
-						split_line = line.split()
-						contig = (split_line[0].replace(">",""))
-					else:
-						seq += line
-				#Iyield last sequence, if it has both a header and sequence
-				if contig and seq:
-					yield([contig,seq])
-			except IOError:
-				print("Could not read file ",fas)
-				sys.exit(1)
-			finally:
-				fh.close()
-	else:
-		raise FileNotFoundError("File %s not found!"%fas)	
-
 #Object to parse command-line arguments
 class parseArgs():
 	def __init__(self):
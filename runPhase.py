@@ -0,0 +1,355 @@
+#!/usr/bin/python
+
+import sys
+import os
+import re
+import getopt
+import glob
+import shlex
+import subprocess
+import time
+
+#Columns of the <out>_jobs.tsv table
+JOB_COLUMNS = ["Locus", "Replicate", "Seed", "Input", "Output", "ExitCode", "Seconds", "Score", "Status"]
+
+def main():
+	params = parseArgs()
+
+	loci = getInputs(params.input)
+	if len(loci) == 0:
+		sys.exit("No .inp files found for input %s"%params.input)
+
+	#One job per locus and replicate, each with its own seed
+	jobs = list()
+	for locus, inp, fas in loci:
+		for rep in range(params.reps):
+			out = params.prefix + "_" + locus + "_rep" + str(rep+1)
+			jobs.append({"Locus":locus, "Replicate":rep+1, "Seed":params.seed+rep, "Input":inp, "Output":out})
+
+	#Keep finished jobs from a previous run, if they still have their outputs
+	table = params.prefix + "_jobs.tsv"
+	done = dict()
+	if params.resume:
+		done = readJobs(table)
+	todo = list()
+	for job in jobs:
+		old = done.get((job["Locus"], str(job["Replicate"])))
+		if old and old["Status"] == "OK" and old["Seed"] == str(job["Seed"]) and outputExists(job["Output"]):
+			job.update(old)
+		else:
+			todo.append(job)
+	print("Found %s loci x %s replicate(s). Running %s job(s) using %s worker(s)..."%(len(loci), params.reps, len(todo), params.threads))
+
+	#Run jobs; each is logged to the table as it finishes, so an
+	#interrupted run can be resumed
+	with open(table, "a" if params.resume and done else "w") as fh:
+		if not (params.resume and done):
+			fh.write("\t".join(JOB_COLUMNS) + "\n")
+		cmds = [(job, phaseCommand(params, job)) for job in todo]
+		if params.threads > 1:
+			#Jobs are external processes, so threads are enough to keep them busy
+			from multiprocessing.pool import ThreadPool
+			with ThreadPool(params.threads) as pool:
+				for job, res in zip(todo, pool.imap(runJob, cmds)):
+					logJob(fh, job, res)
+		else:
+			for job, cmd in zip(todo, cmds):
+				logJob(fh, job, runJob(cmd))
+
+	#Rewrite the table with one row per job
+	failed = [job for job in jobs if job["Status"] != "OK"]
+	writeJobs(table, jobs)
+
+	#Choose the best replicate for each locus, and write a parsePairs.py manifest
+	#Blocks of a locus split with fasta2phase.py -n share one line, listing
+	#their .pairs files in block order along with the block map, so that
+	#parsePairs.py stitches them back together
+	rows = list() #[pairs, fasta, locus, prefix of fasta2phase.py outputs, block map]
+	blockPairs = dict() #block map -> {block .inp file name: best _pairs}
+	for locus, inp, fas in loci:
+		job = bestReplicate([job for job in jobs if job["Locus"] == locus])
+		block = blockMap(inp)
+		if job is None:
+			print("Warning: No replicate finished for locus %s"%locus)
+		if block is None:
+			if job is not None:
+				rows.append([job["Output"] + "_pairs", fas, locus, os.path.splitext(inp)[0], "-"])
+			continue
+		prefix, blocks = block
+		if blocks not in blockPairs:
+			blockPairs[blocks] = dict()
+			rows.append([None, fas, os.path.basename(prefix), prefix, blocks])
+		if job is not None:
+			blockPairs[blocks][os.path.basename(inp)] = job["Output"] + "_pairs"
+	best = params.prefix + "_best.txt"
+	with open(best, "w") as fh:
+		fh.write("#pairs\tfasta\tlocus\tknown\tsites\tblocks\n")
+		for pairs, fas, locus, prefix, blocks in rows:
+			if blocks != "-":
+				order = readBlockInputs(blocks)
+				missing = [b for b in order if b not in blockPairs[blocks]]
+				if missing:
+					print("Warning: %s of %s blocks of locus %s have no finished replicate; it can't be stitched"%(len(missing), len(order), locus))
+					continue
+				pairs = ",".join(blockPairs[blocks][b] for b in order)
+			#Samples held out by fasta2phase.py -k hold, and its site map
+			known = prefix + "_known_pairs"
+			known = known if os.path.isfile(known) else "-"
+			sites = prefix + "_sites.tsv"
+			sites = sites if os.path.isfile(sites) else "-"
+			fh.write("\t".join([pairs, fas if fas else "-", locus, known, sites, blocks]) + "\n")
+	print("Done! %s of %s jobs finished. Job table can be found in %s"%(len(jobs)-len(failed), len(jobs), table))
+	print("Best replicate for each locus is listed in %s (use with parsePairs.py -b)"%best)
+
+#Function to build the command for a job: <exe> <args> -S<seed> [-k<known>] <input> <output> <iterations>
+def phaseCommand(params, job):
+	cmd = [params.exe] + shlex.split(params.args)
+	cmd.append("-S" + str(job["Seed"]))
+	#Samples with known phase, from fasta2phase.py -k file (one per block with -n)
+	known = os.path.splitext(job["Input"])[0] + "_known.txt"
+	if os.path.isfile(known):
+		cmd.append("-k" + known)
+	cmd.extend([job["Input"], job["Output"]])
+	cmd.extend(shlex.split(params.iterations))
+	return(cmd)
+
+#Worker: runs one job (job, command), returns (exit code, seconds, status)
+#Output of the command is written to <output>.log
+def runJob(task):
+	job, cmd = task
+	start = time.time()
+	try:
+		with open(job["Output"] + ".log", "w") as log:
+			code = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+	except OSError as e:
+		return((-1, time.time()-start, "Failed: %s"%e))
+	elapsed = time.time() - start
+	if code != 0:
+		return((code, elapsed, "Failed: exit status %s"%code))
+	if not outputExists(job["Output"]):
+		return((code, elapsed, "Failed: no _pairs output"))
+	return((code, elapsed, "OK"))
+
+#Function to record the result of a job, and append it to the job table
+def logJob(fh, job, res):
+	job["ExitCode"], seconds, job["Status"] = res
+	job["Seconds"] = "%.2f"%seconds
+	score = readScore(job["Output"]) if job["Status"] == "OK" else None
+	job["Score"] = "NA" if score is None else "%.4f"%score
+	if job["Status"] != "OK":
+		print("Warning: Locus %s replicate %s %s"%(job["Locus"], job["Replicate"], job["Status"]))
+	fh.write("\t".join(str(job[c]) for c in JOB_COLUMNS) + "\n")
+	fh.flush()
+
+#Function to get the score of a replicate from PHASE's <output>_monitor file:
+#the mean of the last column (the pseudo-log-likelihood at each iteration)
+#Returns None if there is no monitor file (e.g. for a stand-in command)
+def readScore(out):
+	monitor = out + "_monitor"
+	if not os.path.isfile(monitor):
+		return None
+	values = list()
+	with open(monitor, "r") as fh:
+		for line in fh:
+			stuff = line.split()
+			if not stuff:
+				continue
+			try:
+				values.append(float(stuff[-1]))
+			except ValueError:
+				continue
+	if len(values) == 0:
+		return None
+	return(sum(values)/len(values))
+
+#Function to choose the finished replicate with the highest score (or the
+#first finished replicate, if none have a score). Returns None if none finished
+def bestReplicate(jobs):
+	best = None
+	for job in jobs:
+		if job["Status"] != "OK":
+			continue
+		if best is None:
+			best = job
+		elif job["Score"] != "NA" and (best["Score"] == "NA" or float(job["Score"]) > float(best["Score"])):
+			best = job
+	return(best)
+
+#Function to check that a job left its _pairs output
+def outputExists(out):
+	return(os.path.isfile(out + "_pairs"))
+
+#Function to read a job table as a dict of (locus, replicate) -> row
+#Later rows replace earlier ones for the same job
+def readJobs(table):
+	jobs = dict()
+	if not os.path.isfile(table):
+		return(jobs)
+	with open(table, "r") as fh:
+		for line in fh:
+			stuff = line.rstrip("\n").split("\t")
+			if len(stuff) != len(JOB_COLUMNS) or stuff[0] == "Locus":
+				continue
+			row = dict(zip(JOB_COLUMNS, stuff))
+			jobs[(row["Locus"], row["Replicate"])] = row
+	return(jobs)
+
+#Function to write a job table
+def writeJobs(table, jobs):
+	with open(table, "w") as fh:
+		fh.write("\t".join(JOB_COLUMNS) + "\n")
+		for job in jobs:
+			fh.write("\t".join(str(job[c]) for c in JOB_COLUMNS) + "\n")
+
+#Function to get a list of (locus, inp, fasta) from a directory, glob, or manifest
+#Manifests list one .inp file per line, optionally followed by the FASTA it
+#was made from ("-" for none) and a locus name
+def getInputs(inputs):
+	loci = list()
+	if os.path.isdir(inputs):
+		files = glob.glob(os.path.join(inputs, "*.inp"))
+	elif os.path.isfile(inputs) and not inputs.endswith(".inp"):
+		with open(inputs, "r") as fh:
+			for line in fh:
+				line = line.strip()
+				if not line or line[0] == "#":
+					continue
+				stuff = line.split()
+				fas = stuff[1] if len(stuff) > 1 and stuff[1] != "-" else None
+				locus = stuff[2] if len(stuff) > 2 else locusName(stuff[0])
+				loci.append((locus, stuff[0], fas))
+		return(loci)
+	else:
+		files = glob.glob(inputs)
+	for inp in sorted(files):
+		loci.append((locusName(inp), inp, None))
+	return(loci)
+
+#Function to get (prefix, block map) for a block .inp written by fasta2phase.py -n
+#(<prefix>_block<i>.inp, next to <prefix>_blocks.tsv), or None if inp isn't a block
+def blockMap(inp):
+	match = re.match(r"^(.*)_block\d+$", os.path.splitext(inp)[0])
+	if not match or not os.path.isfile(match.group(1) + "_blocks.tsv"):
+		return None
+	return((match.group(1), match.group(1) + "_blocks.tsv"))
+
+#Function to read the .inp file name of each block, in block order, from a block map
+def readBlockInputs(blocks):
+	with open(blocks, "r") as fh:
+		header = fh.readline().rstrip("\n").split("\t")
+		col = header.index("Input")
+		return([os.path.basename(line.rstrip("\n").split("\t")[col]) for line in fh if line.strip()])
+
+#Function to get a locus name from an .inp path (file name without extension)
+def locusName(inp):
+	return(os.path.splitext(os.path.basename(inp))[0])
+
+
+#Object to parse command-line arguments
+class parseArgs():
+	def __init__(self):
+		#Define options
+		try:
+			options, remainder = getopt.getopt(sys.argv[1:], 'i:o:hx:a:n:r:s:t:R', \
+			["input=","out=","help","exe=","args=","iterations=","reps=","seed=","threads=","resume"])
+		except getopt.GetoptError as err:
+			print(err)
+			self.display_help("\nExiting because getopt returned non-zero exit status.")
+		#Default values for params
+		#Input params
+		self.input=None
+		self.prefix="out"
+
+		#PHASE params
+		self.exe="PHASE"
+		self.args=""
+		self.iterations=""
+		self.reps=1
+		self.seed=1
+		self.threads=1
+		self.resume=False
+
+		#First pass to see if help menu was called
+		for o, a in options:
+			if o in ("-h", "-help", "--help"):
+				self.display_help("Exiting because help menu was called.")
+
+		#Second pass to set all args.
+		for opt, arg_raw in options:
+			arg = arg_raw.strip()
+			opt = opt.replace("-","")
+			#print(opt,arg)
+			if opt in ('i', 'input'):
+				self.input = arg
+			elif opt in ('h', 'help'):
+				pass
+			elif opt in ('o','out'):
+				self.prefix = arg
+			elif opt in ('x','exe'):
+				self.exe = arg
+			elif opt in ('a','args'):
+				self.args = arg
+			elif opt in ('n','iterations'):
+				self.iterations = arg
+			elif opt in ('r','reps'):
+				self.reps = int(arg)
+			elif opt in ('s','seed'):
+				self.seed = int(arg)
+			elif opt in ('t','threads'):
+				self.threads = int(arg)
+			elif opt in ('R','resume'):
+				self.resume = True
+			else:
+				assert False, "Unhandled option %r"%opt
+
+		#Check manditory options are set
+		if not self.input:
+			self.display_help("Error: Missing required input (-i,--input).")
+		if self.reps < 1:
+			self.display_help("Error: Number of replicates (-r,--reps) must be at least 1.")
+		if self.threads < 1:
+			self.display_help("Error: Number of threads (-t,--threads) must be at least 1.")
+
+
+	def display_help(self, message=None):
+		if message is not None:
+			print()
+			print (message)
+		print ("\nrunPhase.py\n")
+		print ("Contact:Tyler K. Chafin, University of Arkansas,tkchafin@uark.edu")
+		print ("\nUsage: ", sys.argv[0], "-i <.inp, dir, 'glob', or manifest>  <-r replicates> <-t threads> <-o out_prefix>\n")
+		print ("Description: Runs PHASE on .inp files from fasta2phase.py over a pool of workers, with replicate seeds")
+
+		print("""
+	Input options:
+		-i,--input	: .inp file, directory of .inp files, quoted glob (e.g. 'phase/*.inp'),
+			  or manifest file listing one .inp per line (optional 2nd column: FASTA
+			  used with fasta2phase.py, or "-"; optional 3rd column: locus name)
+		-o,--out	: Prefix for output files <default = ./out>
+		-h,--help	: Displays help menu
+
+	PHASE options:
+		-x,--exe	: PHASE executable, or a stand-in command taking the same
+			  arguments <default = PHASE>
+		-a,--args	: Quoted extra options passed to PHASE (e.g. '-MR -F0.05')
+		-n,--iterations	: Quoted iterations, thinning, burn-in (e.g. '100 1 100')
+		-r,--reps	: Number of replicate runs per locus <default = 1>
+		-s,--seed	: Seed of the first replicate; replicate i uses seed+i-1 <default = 1>
+		-t,--threads	: Number of PHASE runs at once <default = 1>
+		-R,--resume	: Only re-run jobs that failed or are missing from a previous run
+
+	Outputs:
+		--Each job writes <out_prefix>_<locus>_rep<i> (plus PHASE's _pairs, _monitor, etc.)
+		  and a .log of its screen output
+		--<out_prefix>_jobs.tsv lists exit status, wall time and score for each job
+		--<out_prefix>_best.txt lists the best replicate of each locus (highest mean
+		  pseudo-log-likelihood in the _monitor file), as a manifest for parsePairs.py -b
+		  (blocks from fasta2phase.py -n are listed on one line, with their block map)
+		--An <input>_known.txt from fasta2phase.py -k file is passed to PHASE with -k""")
+		print()
+		sys.exit()
+
+
+#Call main function
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+import os
+import gzip
+import re
+import itertools
+import numpy as np
+import alignment_tools as aln
+
+############################# CLASSES ##################################
+
+class vcfReader():
+	'Streams SNP records from a VCF file (plain or gzip), optionally within a region'
+	#Default constructor
+	#region is "chrom", "chrom:start" or "chrom:start-end" (1-based, inclusive)
+	#Sample names are read from the #CHROM header line
+	def __init__(self, vcf, region=None):
+		if not os.path.isfile(vcf):
+			raise FileNotFoundError("File %s not found!"%vcf)
+		self.vcf = vcf
+		self.chrom, self.start, self.end = parse_region(region) if region else (None, None, None)
+		self.samples = list()
+		self.skipped = 0 #records in the region that aren't SNPs, or have no GT
+		self._fh = open_vcf(vcf)
+		self._first = None
+		for line in self._fh:
+			if line.startswith(b"#CHROM"):
+				self.samples = [s.decode("utf-8") for s in line.rstrip(b"\r\n").split(b"\t")[9:]]
+			elif not line.startswith(b"#"):
+				self._first = line
+				break
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._fh.close()
+
+	#Yields (chrom, 1-based position, alleles, genotypes, phase sets) for each SNP
+	#record, where alleles are the REF and ALT bases (bytes), genotypes are as for
+	#parse_genotypes and phase sets as for parse_phase_sets (None without a PS
+	#field). Without a region, all records must be on one chromosome
+	def __iter__(self):
+		seen = None
+		lines = [self._first] if self._first else []
+		for line in itertools.chain(lines, self._fh):
+			#Sample columns are left as one string for parse_genotypes
+			fields = line.rstrip(b"\r\n").split(b"\t", 9)
+			if len(fields) < 10:
+				continue
+			chrom = fields[0].decode("utf-8")
+			pos = int(fields[1])
+			if self.chrom is not None:
+				if chrom != self.chrom:
+					#VCF is sorted, so the region is finished once its chromosome is
+					if seen is not None:
+						break
+					continue
+				seen = chrom
+				if self.start is not None and pos < self.start:
+					continue
+				if self.end is not None and pos > self.end:
+					break
+			elif seen is None:
+				seen = chrom
+			elif chrom != seen:
+				raise ValueError("VCF %s has records for more than one chromosome (%s, %s); give a region"%(self.vcf, seen, chrom))
+			alleles = [fields[3]] + fields[4].split(b",")
+			if not all(len(a) == 1 and a in _BASES for a in alleles):
+				self.skipped += 1
+				continue
+			fmt = fields[8].split(b":")
+			if b"GT" not in fmt:
+				self.skipped += 1
+				continue
+			sets = parse_phase_sets(fields[9], fmt.index(b"PS")) if b"PS" in fmt else None
+			yield((chrom, pos, alleles, parse_genotypes(fields[9], fmt.index(b"GT")), sets))
+
+
+######################## STATIC FUNCTIONS ##############################
+
+#Function to open a VCF as binary lines, decompressing if it starts with the gzip
+#magic number (this includes bgzip)
+def open_vcf(vcf):
+	with open(vcf, "rb") as fh:
+		magic = fh.read(2)
+	if magic == b"\x1f\x8b":
+		return(gzip.open(vcf, "rb"))
+	return(open(vcf, "rb"))
+
+#Function to parse a region string as (chrom, start, end); start and end are
+#1-based and inclusive, or None if not given
+def parse_region(region):
+	match = re.match(r"^([^:]+)(?::([\d,]+)(?:-([\d,]+))?)?$", region)
+	if not match:
+		raise ValueError("Can't parse region %s (expected chrom, chrom:start or chrom:start-end)"%region)
+	chrom, start, end = match.groups()
+	start = int(start.replace(",", "")) if start else None
+	end = int(end.replace(",", "")) if end else None
+	if start is not None and end is not None and end < start:
+		raise ValueError("Region %s ends before it starts"%region)
+	return((chrom, start, end))
+
+#Function to parse the GT field of each sample, from the tab-separated sample
+#columns of a record (gt is the index of GT in FORMAT)
+#Returns (first allele, second allele, phased) as arrays, with -1 for a missing
+#allele. Haploid calls are returned as homozygous and phased
+#Usual single-digit diploid calls ("0|1", "1/1", "./.") are parsed all at once,
+#straight from the line's bytes when GT is the first FORMAT field
+def parse_genotypes(samples, gt=0):
+	if gt == 0:
+		buf = np.frombuffer(samples + b"\t", dtype=np.uint8)
+		ends = np.flatnonzero(buf == ord("\t"))
+		starts = np.concatenate(([0], ends[:-1] + 1))
+		if ((ends - starts) >= 3).all():
+			after = buf[starts + 3]
+			if ((after == ord("\t")) | (after == ord(":"))).all():
+				res = _diploid_calls(buf[starts[:, None] + np.arange(3)])
+				if res is not None:
+					return(res)
+		calls = [f.split(b":", 1)[0] for f in samples.split(b"\t")]
+	else:
+		calls = [f.split(b":")[gt] if f.count(b":") >= gt else b"." for f in samples.split(b"\t")]
+	joined = b"".join(calls)
+	if len(joined) == 3*len(calls):
+		res = _diploid_calls(np.frombuffer(joined, dtype=np.uint8).reshape(-1, 3))
+		if res is not None:
+			return(res)
+	#Anything else (haploid, multi-digit alleles, ...) one call at a time
+	first = np.full(len(calls), -1, dtype=np.int16)
+	second = np.full(len(calls), -1, dtype=np.int16)
+	phased = np.zeros(len(calls), dtype=bool)
+	for i, call in enumerate(calls):
+		stuff = re.split(rb"[/|]", call)
+		values = [-1 if a in (b".", b"") else int(a) for a in stuff[:2]]
+		first[i] = values[0]
+		second[i] = values[1] if len(values) > 1 else values[0]
+		phased[i] = len(values) == 1 or b"|" in call
+	return((first, second, phased))
+
+#Function to parse the PS (phase set) field of each sample, from the tab-separated
+#sample columns of a record (ps is the index of PS in FORMAT)
+#Returns the phase sets as an array, with -1 where a sample has no PS value
+def parse_phase_sets(samples, ps):
+	fields = samples.split(b"\t")
+	sets = np.full(len(fields), -1, dtype=np.int64)
+	for i, f in enumerate(fields):
+		values = f.split(b":")
+		if len(values) > ps and values[ps] not in (b".", b""):
+			sets[i] = int(values[ps])
+	return(sets)
+
+#Function to parse 3-character GT calls (one row of ASCII codes per sample)
+#Returns as for parse_genotypes, or None if any call isn't of the form "0/1"
+def _diploid_calls(arr):
+	sep = arr[:, 1]
+	if not (np.isin(sep, _SEPARATORS).all() and _GT_DIGIT[arr[:, 0::2]].all()):
+		return None
+	alleles = arr[:, 0::2].astype(np.int16) - ord("0")
+	alleles[alleles < 0] = -1 #"."
+	return((alleles[:, 0], alleles[:, 1], sep == ord("|")))
+
+#Function to convert genotypes (see parse_genotypes) to IUPAC characters (uint8)
+#The two alleles' bases are combined as an ambiguity code; N if either is missing
+def genotype_chars(alleles, first, second):
+	bits = aln.encode_iupac(np.frombuffer(b"".join(alleles), dtype=np.uint8))
+	missing = (first < 0) | (second < 0) | (first >= len(alleles)) | (second >= len(alleles))
+	codes = np.where(missing, 15, bits[np.where(missing, 0, first)] | bits[np.where(missing, 0, second)])
+	return(np.frombuffer(aln.decode_iupac(codes.astype(np.uint8)).encode("ascii"), dtype=np.uint8))
+
+######################## LOOKUP TABLES #################################
+
+#Bases allowed as REF/ALT alleles of a SNP
+_BASES = [b"A", b"C", b"G", b"T"]
+
+#ASCII of GT allele separators
+_SEPARATORS = np.array([ord("/"), ord("|")], dtype=np.uint8)
+
+#ASCII -> True for characters allowed as a single-character GT allele
+_GT_DIGIT = np.zeros(256, dtype=bool)
+_GT_DIGIT[ord("0"):ord("9")+1] = True
+_GT_DIGIT[ord(".")] = True